@@ -36,11 +36,27 @@ Options:
   --packages=<pkgs>              Comma-separated list of additional packages to install.
   --recipes=<recipes>            Comma-separated list of installer scripts to run.
   --scripts=<scripts>            Comma-separated list of test scripts to execute.
+  --estargz                      Also export the rootfs as a lazy-pullable eStargz layer.
+  --prioritized_files=<file>     File listing paths to prefetch first in the eStargz layer.
+  --no-cache                     Rebuild every step instead of replaying cached rootfs snapshots.
+  --tmpfs                        Build the rootfs on a size-limited tmpfs sized from the target's peak footprint.
   --help                         Display this help message.
 
 Example:
   ${0} --name=my-image --release=bullseye --packages=curl,vim --scripts=test.sh
 
+Environment:
+  CT_CACHE_DIR            Step cache location (default: debian/cache).
+  CT_CACHE_MAX_SIZE_MB    Evict least recently used entries above this size (default: 10240).
+  CT_CACHE_MAX_AGE_DAYS   Evict entries not used for this many days (default: 14).
+  CT_APT_PREFETCH         Set to 0 to let apt download --packages itself (default: 1).
+  CT_APT_JOBS             Concurrent .deb downloads for --packages (default: 8).
+  CT_TMPFS_DEFAULT_MB     tmpfs budget for targets without a recorded peak (default: 4096).
+  CT_TMPFS_HEADROOM_PCT   Budget above the recorded peak footprint (default: 25).
+  CT_TMPFS_MAX_PCT        Share of RAM all concurrent --tmpfs builds may reserve (default: 50).
+  CT_TMPFS_FALLBACK_PCT   Move the rootfs to disk when a step leaves this much of the budget used (default: 90).
+  CT_TMPFS_MARGIN_PCT     tmpfs hard cap above the budget, for steps that outgrow it (default: 50).
+
 Notes:
   - Ensure that debootstrap, unzip, and trivy are installed on your system.
   - The script requires root privileges for certain operations.
@@ -126,6 +142,18 @@ while getopts ":-:" optchar; do
     scripts=${OPTARG#*=}
     scripts=("${scripts//,/ }")
     ;;
+  estargz)
+    estargz=1
+    ;;
+  prioritized_files=*)
+    prioritized_files=${OPTARG#*=}
+    ;;
+  no-cache)
+    no_cache=1
+    ;;
+  tmpfs)
+    tmpfs=1
+    ;;
   help*)
     usage
     ;;
@@ -357,6 +385,7 @@ mkdir --parents "$DOWNLOAD"
 cleanup() {
   # Best-effort unmount and cleanup
   umount_target_fs || true
+  tmpfs_cleanup || true
   [[ -n "${target:-}" && -d "$target" ]] && rm --recursive --force "$target" || true
   [[ -n "${debootstrap_dir:-}" && -d "$debootstrap_dir" ]] && rm --recursive --force "$debootstrap_dir" || true
 }
@@ -366,21 +395,478 @@ trap 'cleanup' EXIT INT TERM
 repo_url="http://deb.debian.org/debian"
 sec_repo_url="http://security.debian.org/debian-security"
 
-############################## SCRIPT MAIN ##############################
+########################### TMPFS BUILD ROOT ###########################
+
+# With --tmpfs the target directory is a tmpfs. The budget is the peak footprint
+# recorded by the previous build of the same target plus headroom. The tmpfs is
+# capped a bounded margin above the budget (it only uses the pages actually written),
+# so a step that outgrows the budget still completes and the rootfs moves to disk
+# after it. A host-wide ledger reserves every running build's cap within a share of
+# RAM, so parallel builds either fit or build on disk from the start.
+tmpfs_peak_file="$dist/$name.peak"
+tmpfs_ledger="${CT_TMPFS_LEDGER:-/dev/shm/ct-tmpfs}"
+tmpfs_default_mb="${CT_TMPFS_DEFAULT_MB:-4096}"
+tmpfs_headroom_pct="${CT_TMPFS_HEADROOM_PCT:-25}"
+tmpfs_max_pct="${CT_TMPFS_MAX_PCT:-50}"
+tmpfs_fallback_pct="${CT_TMPFS_FALLBACK_PCT:-90}"
+tmpfs_margin_pct="${CT_TMPFS_MARGIN_PCT:-50}"
+
+# Budget in MB: recorded peak plus headroom, or the default for unknown targets
+tmpfs_budget_mb() {
+  local peak_kb
+
+  peak_kb="$(cat "$tmpfs_peak_file" 2>/dev/null || true)"
+  if [[ "$peak_kb" =~ ^[0-9]+$ ]] && (( peak_kb > 0 )); then
+    echo $(( (peak_kb * (100 + tmpfs_headroom_pct) / 100 + 1023) / 1024 + 256 ))
+  else
+    echo "$tmpfs_default_mb"
+  fi
+}
 
-main() {
-  timer-on
+# Reserve the mount's hard cap in the host-wide ledger; fails if not even the budget fits the RAM share
+tmpfs_reserve() {
+  local budget="$1"
+  local mem_mb limit_mb reserved_mb=0 entry pid
+
+  mem_mb=$(( $(awk '/^MemTotal:/ { print $2 }' /proc/meminfo) / 1024 ))
+  limit_mb=$(( mem_mb * tmpfs_max_pct / 100 ))
+  mkdir --parents "$tmpfs_ledger"
+  exec 9>"$tmpfs_ledger/.lock"
+  flock 9
+  for entry in "$tmpfs_ledger"/*.budget; do
+    [[ -f "$entry" ]] || continue
+    pid="$(basename "$entry" .budget)"
+    # Drop reservations of builds that are gone
+    if ! kill -0 "$pid" 2>/dev/null; then
+      rm --force "$tmpfs_ledger/$pid".*
+      continue
+    fi
+    reserved_mb=$(( reserved_mb + $(cat "$entry") ))
+  done
+  if (( reserved_mb + budget > limit_mb )); then
+    warn "tmpfs budget of ${budget} MB does not fit: ${reserved_mb} MB already reserved, limit ${limit_mb} MB (${tmpfs_max_pct}% of ${mem_mb} MB RAM)"
+    flock --unlock 9
+    return 1
+  fi
+  # Hard cap for the mount: the budget plus a margin, trimmed to the room left; the whole
+  # cap is reserved so all running builds together stay within the RAM share
+  tmpfs_cap_mb=$(( budget * (100 + tmpfs_margin_pct) / 100 ))
+  if (( reserved_mb + tmpfs_cap_mb > limit_mb )); then
+    tmpfs_cap_mb=$(( limit_mb - reserved_mb ))
+  fi
+  echo "$tmpfs_cap_mb" > "$tmpfs_ledger/$$.budget"
+  flock --unlock 9
+}
 
-  # Fix GPG directory and import keys
-  header "Setting up GPG directory"
-  run rm -rf /root/.gnupg
-  run mkdir -p /root/.gnupg
-  run chmod 700 /root/.gnupg
+# Remember the largest usage seen in this build
+tmpfs_note_peak() {
+  local used_kb="$1"
+  local peak_kb
 
-  header "Importing GPG keys"
-  run gpg --batch --no-default-keyring --keyring /root/.gnupg/trustedkeys.gpg --import "$scriptdir"/keys/buster.gpg
-  run gpg --batch --no-default-keyring --keyring /root/.gnupg/trustedkeys.gpg --import "$scriptdir"/keys/unstable.gpg
-  
+  peak_kb="$(cat "$tmpfs_ledger/$$.peak" 2>/dev/null || echo 0)"
+  if (( used_kb > peak_kb )); then
+    echo "$used_kb" > "$tmpfs_ledger/$$.peak"
+  fi
+}
+
+# Sample usage while steps run and warn once over budget and once near the hard cap
+tmpfs_watch() {
+  local owner="$1"
+  local used_kb size_kb over=0 warned=0
+
+  # Stop with the build; a leftover watcher would keep the log pipe open
+  while kill -0 "$owner" 2>/dev/null && mountpoint -q "$target"; do
+    read -r used_kb size_kb < <(df --block-size=1K --output=used,size "$target" | tail --lines 1)
+    tmpfs_note_peak "$used_kb"
+    if (( !over && used_kb > tmpfs_budget * 1024 )); then
+      warn "tmpfs build root is over its ${tmpfs_budget} MB budget; the build moves to disk after the running step"
+      over=1
+    fi
+    if (( !warned && used_kb * 100 >= size_kb * 95 )); then
+      warn "tmpfs build root is ${used_kb} of ${size_kb} KB full; the running step may fail with 'No space left on device'"
+      warned=1
+    fi
+    sleep 1
+  done
+}
+
+# Mount the tmpfs on the target directory, or stay on disk when the budget does not fit
+tmpfs_setup() {
+  tmpfs_budget="$(tmpfs_budget_mb)"
+  mkdir --parents "$tmpfs_ledger"
+  echo 0 > "$tmpfs_ledger/$$.peak"
+  if [[ -f "$tmpfs_peak_file" ]]; then
+    info "Recorded peak footprint for $name: $(( $(cat "$tmpfs_peak_file") / 1024 )) MB"
+  else
+    info "No recorded peak footprint for $name; using the default budget"
+  fi
+  if ! tmpfs_reserve "$tmpfs_budget"; then
+    warn "Building $name on disk in $target"
+    return 0
+  fi
+  if ! mount -t tmpfs -o "size=${tmpfs_cap_mb}m,mode=0755" ct-build "$target"; then
+    warn "Could not mount a tmpfs on $target; building $name on disk"
+    rm --force "$tmpfs_ledger/$$.budget"
+    return 0
+  fi
+  tmpfs_active=1
+  # Expand BASHPID before forking so the watcher gets the build's pid, not its own
+  local owner="$BASHPID"
+  tmpfs_watch "$owner" &
+  tmpfs_watcher=$!
+  info "Building $name on a tmpfs at $target (budget ${tmpfs_budget} MB, hard cap ${tmpfs_cap_mb} MB)"
+}
+
+# Check usage after a step and move the rootfs to disk when it is too full to go on
+tmpfs_check() {
+  local step="$1"
+  local used_kb size_kb
+
+  [[ -n "${tmpfs:-}" ]] || return 0
+  if [[ -z "${tmpfs_active:-}" ]]; then
+    # Keep measuring on disk so the next build gets a budget that fits
+    tmpfs_note_peak "$(du --summarize --one-file-system --block-size=1K "$target" | cut --fields 1)"
+    return 0
+  fi
+  read -r used_kb size_kb < <(df --block-size=1K --output=used,size "$target" | tail --lines 1)
+  tmpfs_note_peak "$used_kb"
+  info "tmpfs build root: $(( used_kb / 1024 )) MB of the ${tmpfs_budget} MB budget used after $step"
+  if (( used_kb * 100 > tmpfs_budget * 1024 * tmpfs_fallback_pct )); then
+    tmpfs_to_disk "$(( used_kb / 1024 )) MB used after $step is over ${tmpfs_fallback_pct}% of the ${tmpfs_budget} MB budget"
+  fi
+}
+
+# Copy the rootfs from the tmpfs to a disk directory and continue there
+tmpfs_to_disk() {
+  local disk remount=0
+
+  warn "Falling back to disk: $1"
+  mountpoint -q "$target/proc" && remount=1
+  umount_target_fs
+  disk="$(mktemp --directory)"
+  run cp --archive --one-file-system "$target/." "$disk/"
+  tmpfs_unmount
+  run rmdir "$target"
+  run mv "$disk" "$target"
+  if (( remount )); then
+    mount_target_fs
+  fi
+  info "Continuing the build of $name on disk in $target"
+}
+
+# Stop the watcher, drop the tmpfs contents and release the reservation
+tmpfs_unmount() {
+  if [[ -n "${tmpfs_watcher:-}" ]]; then
+    kill "$tmpfs_watcher" 2>/dev/null || true
+    wait "$tmpfs_watcher" 2>/dev/null || true
+    tmpfs_watcher=""
+  fi
+  if mountpoint -q "$target"; then
+    run umount "$target"
+  fi
+  rm --force "$tmpfs_ledger/$$.budget"
+  tmpfs_active=""
+}
+
+# Store this build's peak footprint as the next build's budget basis
+tmpfs_record_peak() {
+  local peak_kb recorded_kb
+
+  peak_kb="$(cat "$tmpfs_ledger/$$.peak" 2>/dev/null || echo 0)"
+  # Replayed cache steps skip the scratch space their recipes need, so only a full build may lower the peak
+  if [[ -n "${cache_replayed:-}" ]]; then
+    recorded_kb="$(cat "$tmpfs_peak_file" 2>/dev/null || echo 0)"
+    if (( recorded_kb > peak_kb )); then
+      info "Keeping the recorded peak footprint of $(( recorded_kb / 1024 )) MB; this build replayed cached steps"
+      return 0
+    fi
+  fi
+  if (( peak_kb > 0 )); then
+    echo "$peak_kb" > "$tmpfs_peak_file"
+    info "Peak rootfs footprint: $(( peak_kb / 1024 )) MB${tmpfs_budget:+ (budget ${tmpfs_budget} MB)}"
+  fi
+}
+
+# Exit trap: unmount and, after a failed build, raise the recorded peak if it was exceeded
+tmpfs_cleanup() {
+  local peak_kb recorded_kb
+
+  [[ -n "${tmpfs:-}" ]] || return 0
+  if mountpoint -q "$target"; then
+    read -r peak_kb recorded_kb < <(df --block-size=1K --output=used,size "$target" | tail --lines 1)
+    # A full tmpfs says nothing about the real need; double the budget for the next attempt
+    if (( peak_kb * 100 >= recorded_kb * 95 )); then
+      warn "The ${recorded_kb} KB tmpfs hard cap was exhausted"
+      peak_kb=$(( recorded_kb * 2 ))
+    fi
+    tmpfs_note_peak "$peak_kb"
+    umount "$target" || umount -l "$target"
+  fi
+  peak_kb="$(cat "$tmpfs_ledger/$$.peak" 2>/dev/null || echo 0)"
+  recorded_kb="$(cat "$tmpfs_peak_file" 2>/dev/null || echo 0)"
+  if (( peak_kb > recorded_kb )); then
+    echo "$peak_kb" > "$tmpfs_peak_file"
+    warn "Recorded a peak footprint of $(( peak_kb / 1024 )) MB for $name; the next --tmpfs build gets a larger budget"
+  fi
+  rm --force "$tmpfs_ledger/$$".*
+}
+
+############################## STEP CACHE ##############################
+
+# Rootfs snapshots are cached per build step. The base rootfs (debootstrap plus
+# --packages) is stored whole; every recipe stores only its delta on top of the
+# previous step. Keys chain: each step key hashes the state digest of its parent
+# entry, the recipe content and the environment overrides the recipe reads, so
+# editing one recipe only invalidates that recipe and the ones after it, and a
+# rebuilt parent never has stale deltas replayed on top of it.
+cache_dir="${CT_CACHE_DIR:-$scriptdir/cache}"
+cache_max_size_mb="${CT_CACHE_MAX_SIZE_MB:-10240}"
+cache_max_age_days="${CT_CACHE_MAX_AGE_DAYS:-14}"
+cache_version=2
+
+# Hash stdin into a cache key
+cache_digest() {
+  sha256sum | cut --delimiter ' ' --fields 1
+}
+
+# Key for the base rootfs produced by debootstrap and --packages
+cache_base_key() {
+  {
+    echo "version=$cache_version"
+    echo "release=$release variant=$variant foreign=${USE_DEBOOTSTRAP_FOREIGN:-}"
+    echo "debootstrap_packages=${debootstrap_packages:-}"
+    echo "packages=${packages[*]:-}"
+    echo "repos=$repo_url $sec_repo_url"
+    sha256sum "$keyring" | cut --delimiter ' ' --fields 1
+    cat "$scriptdir"/debootstrap/* | sha256sum
+  } | cache_digest
+}
+
+# Key for a recipe step: parent state, recipe content and the env overrides it reads
+cache_recipe_key() {
+  local parent="$1"
+  local recipe="$2"
+  local var
+
+  {
+    echo "version=$cache_version"
+    echo "parent=$parent"
+    sha256sum < "$recipe"
+    # Recipes read overrides as ${NAME:-default}; only variables set here matter
+    for var in $(grep --only-matching --extended-regexp '\$\{[A-Za-z_][A-Za-z0-9_]*:-' "$recipe" | sed 's/^${//; s/:-$//' | sort --unique); do
+      if [[ -n "${!var+x}" ]]; then
+        echo "$var=${!var}"
+      fi
+    done
+  } | cache_digest
+}
+
+# Check whether a complete cache entry exists (always false with --no-cache)
+cache_has() {
+  [[ -z "${no_cache:-}" && -f "$cache_dir/$1/complete" ]]
+}
+
+# Move a finished entry into place so readers never see a partial snapshot
+cache_commit() {
+  local key="$1"
+  local staging="$2"
+
+  touch "$staging/complete"
+  rm --recursive --force "${cache_dir:?}/$key"
+  mv "$staging" "$cache_dir/$key"
+}
+
+# Print the state digest of an entry: what the rootfs looks like after replaying it
+cache_state() {
+  cat "$cache_dir/$1/state"
+}
+
+# Snapshot the whole rootfs as the base entry; its state is the digest of the snapshot
+cache_save_base() {
+  local key="$1"
+  local staging
+
+  mkdir --parents "$cache_dir"
+  staging="$(mktemp --directory "$cache_dir/.staging-XXXXX")"
+  info "Saving base rootfs to cache ($key)"
+  run tar --numeric-owner --one-file-system -czf "$staging/rootfs.tar.gz" --directory "$target" .
+  cache_digest < "$staging/rootfs.tar.gz" > "$staging/state"
+  cache_commit "$key" "$staging"
+}
+
+# Restore the base rootfs entry into the target directory
+cache_restore_base() {
+  local key="$1"
+
+  run tar --numeric-owner -xpzf "$cache_dir/$key/rootfs.tar.gz" --directory "$target"
+  touch "$cache_dir/$key"
+}
+
+# Record the rootfs state before a recipe runs
+cache_begin_step() {
+  step_marker="$tmpdir/step.marker"
+  step_before="$tmpdir/step.before"
+  touch "$step_marker"
+  (cd "$target" && find . -xdev -print0 | sort --zero-terminated) > "$step_before"
+}
+
+# Store files created or changed since cache_begin_step, plus deleted paths
+cache_save_step() {
+  local key="$1"
+  local parent="$2"
+  local staging
+
+  mkdir --parents "$cache_dir"
+  staging="$(mktemp --directory "$cache_dir/.staging-XXXXX")"
+  info "Saving recipe delta to cache ($key)"
+  # ctime is updated on create and modify, even when a recipe preserves archive mtimes
+  (cd "$target" && find . -xdev ! -path . -cnewer "$step_marker" -print0) > "$staging/changed"
+  (cd "$target" && find . -xdev -print0 | sort --zero-terminated) | comm -z -23 "$step_before" - > "$staging/deleted"
+  run tar --numeric-owner --no-recursion --null -czf "$staging/delta.tar.gz" --directory "$target" --files-from "$staging/changed"
+  # The parent link lets eviction drop descendants together with their ancestor
+  echo "$parent" > "$staging/parent"
+  { cache_state "$parent"; cache_digest < "$staging/delta.tar.gz"; } | cache_digest > "$staging/state"
+  cache_commit "$key" "$staging"
+}
+
+# Replay a recipe delta on top of the current rootfs
+cache_restore_step() {
+  local key="$1"
+
+  (cd "$target" && sort --zero-terminated --reverse "$cache_dir/$key/deleted" | xargs --null --no-run-if-empty rm --recursive --force --)
+  run tar --numeric-owner -xpzf "$cache_dir/$key/delta.tar.gz" --directory "$target"
+  touch "$cache_dir/$key"
+}
+
+# Remove an entry and every entry built on top of it
+cache_evict_entry() {
+  local key="$1"
+  local child
+
+  info "Evicting cache entry: $key"
+  rm --recursive --force "${cache_dir:?}/$key"
+  for child in $(grep --files-with-matches --line-regexp --fixed-strings -- "$key" "$cache_dir"/*/parent 2>/dev/null); do
+    cache_evict_entry "$(basename "$(dirname "$child")")"
+  done
+}
+
+# Drop entries older than the age limit, then the least recently used ones over the size limit
+cache_evict() {
+  local entry
+
+  [[ -d "$cache_dir" ]] || return 0
+  while read -r entry; do
+    # Already gone when an evicted ancestor took it along
+    [[ -d "$entry" ]] || continue
+    cache_evict_entry "$(basename "$entry")"
+  done < <(find "$cache_dir" -mindepth 1 -maxdepth 1 -type d -mtime +"$cache_max_age_days")
+  while (( $(du --summarize --block-size=1M "$cache_dir" | cut --fields 1) > cache_max_size_mb )); do
+    entry="$(find "$cache_dir" -mindepth 1 -maxdepth 1 -type d -printf '%T@ %p\n' | sort --numeric-sort | head --lines 1 | cut --delimiter ' ' --fields 2-)"
+    [[ -n "$entry" ]] || break
+    cache_evict_entry "$(basename "$entry")"
+  done
+  info "Step cache size: $(du --summarize --human-readable "$cache_dir" | cut --fields 1) ($cache_dir)"
+}
+
+# Install packages in the chroot (apt lists must be current)
+apt_install() {
+  # Resolve and download the whole dependency closure in parallel so apt installs from local files
+  local install_args=(--yes --no-install-recommends)
+  if [[ "${CT_APT_PREFETCH:-1}" != "0" ]] && command -v python3 >/dev/null 2>&1; then
+    echo >&2 "$(timestamp) RUN apt_prefetch.py --root $target --packages $*"
+    if python3 "$(cd "$scriptdir/.." && pwd)/scripts/apt_prefetch.py" --root "$target" --packages "$*" --jobs "${CT_APT_JOBS:-8}"; then
+      # The resolver ignores Conflicts/Breaks and pinning; if apt picks a .deb that is not
+      # in the cache, the offline transaction fails and a normal install takes over
+      chroot "$target" apt-get install "${install_args[@]}" --no-download "$@" && return 0
+      warn "Install from the prefetched .debs failed; apt will download the missing packages"
+    else
+      warn "Parallel .deb prefetch failed; apt will download the packages itself"
+    fi
+  fi
+  retry 3 chroot "$target" apt-get install "${install_args[@]}" "$@"
+}
+
+########################### RECIPE DEPENDENCIES ###########################
+
+# Recipes declare their apt needs in header comments:
+#   # ct-apt-packages: ca-certificates curl   installed before any recipe runs
+#   # ct-build-only: xz-utils                 also installed, purged after the last recipe
+# mkimage.sh merges the headers of every --recipes entry into one apt-get update and
+# one install, and exports CT_RECIPE_DEPS=1 so recipes skip their own apt calls.
+# Recipes run outside mkimage.sh keep installing what they need themselves.
+
+# Print the words of every "# ct-<field>:" header line of a recipe
+recipe_header() {
+  local field="$1"
+  local recipe="$2"
+
+  sed --quiet --regexp-extended "s/^#[[:space:]]*ct-${field}:[[:space:]]*//p" "$recipe" | tr '\n' ' '
+}
+
+# Merge the headers of all recipes into recipe_apt_packages and recipe_purge
+collect_recipe_deps() {
+  local recipe pkg required build_only
+  local -A wanted=() runtime=() build=()
+
+  recipe_apt_packages=()
+  recipe_purge=()
+  recipe_deps_count=0
+  recipe_purge_count=0
+  recipe_gated_count=0
+  recipe_gated_purge_count=0
+  recipe_guarded_count=0
+  while read -r recipe; do
+    required="$(recipe_header apt-packages "$recipe")"
+    build_only="$(recipe_header build-only "$recipe")"
+    [[ -n "${required// /}${build_only// /}" ]] || continue
+    recipe_deps_count=$((recipe_deps_count + 1))
+    [[ -z "${build_only// /}" ]] || recipe_purge_count=$((recipe_purge_count + 1))
+    # Recipes save their own update/install (and purge) when they skip them under CT_RECIPE_DEPS,
+    # or when their installs are guarded by a tool check that now finds the tool present
+    if grep --quiet 'CT_RECIPE_DEPS' "$recipe"; then
+      recipe_gated_count=$((recipe_gated_count + 1))
+      [[ -z "${build_only// /}" ]] || recipe_gated_purge_count=$((recipe_gated_purge_count + 1))
+    elif grep --quiet 'apt-get install' "$recipe" && grep --quiet --extended-regexp 'if ! (command -v|dpkg)|dpkg-query' "$recipe"; then
+      recipe_guarded_count=$((recipe_guarded_count + 1))
+    fi
+    for pkg in $required $build_only; do
+      if [[ -z "${wanted[$pkg]:-}" ]]; then
+        wanted[$pkg]=1
+        recipe_apt_packages+=("$pkg")
+      fi
+    done
+    for pkg in $build_only; do
+      build[$pkg]=1
+    done
+    # A package some recipe needs at runtime is never purged
+    for pkg in $required; do
+      [[ " $build_only " == *" $pkg "* ]] || runtime[$pkg]=1
+    done
+  done < <(print-array ${recipes[@]})
+
+  for pkg in ${packages[@]:-}; do
+    runtime[$pkg]=1
+  done
+  for pkg in "${recipe_apt_packages[@]}"; do
+    if [[ -n "${build[$pkg]:-}" && -z "${runtime[$pkg]:-}" ]]; then
+      recipe_purge+=("$pkg")
+    fi
+  done
+}
+
+# Key for the merged recipe dependency step
+cache_deps_key() {
+  {
+    echo "version=$cache_version"
+    echo "parent=$1"
+    echo "recipe-deps=${recipe_apt_packages[*]}"
+  } | cache_digest
+}
+
+############################## SCRIPT MAIN ##############################
+
+# Create the base rootfs with debootstrap, configure apt and install --packages
+bootstrap_rootfs() {
   header "Preparing debootstrap scripts"
   run cp --archive /usr/share/debootstrap/* "$debootstrap_dir"
   run cp --archive "$scriptdir"/debootstrap/* "$debootstrap_dir/scripts"
@@ -421,29 +907,135 @@ main() {
     info "The following packages will be installed in chroot:"
     print-array ${packages[@]}
     echo
-    run chroot "$target" apt-get update && retry 3 chroot "$target" apt-get install --yes --no-install-recommends "${packages[@]}"
+    run chroot "$target" apt-get update
+    apt_install "${packages[@]}"
     info "Installed packages:"
     chroot "$target" dpkg-query --show --showformat='${Package} ${Installed-Size}\n'
   fi
+}
+
+main() {
+  timer-on
+
+  if [[ -n "${tmpfs:-}" ]]; then
+    header "Preparing tmpfs build root"
+    tmpfs_setup
+  fi
+
+  # Fix GPG directory and import keys
+  header "Setting up GPG directory"
+  run rm -rf /root/.gnupg
+  run mkdir -p /root/.gnupg
+  run chmod 700 /root/.gnupg
+
+  header "Importing GPG keys"
+  run gpg --batch --no-default-keyring --keyring /root/.gnupg/trustedkeys.gpg --import "$scriptdir"/keys/buster.gpg
+  run gpg --batch --no-default-keyring --keyring /root/.gnupg/trustedkeys.gpg --import "$scriptdir"/keys/unstable.gpg
+  
+  base_key="$(cache_base_key)"
+  replaying=1
+  if cache_has "$base_key"; then
+    header "Restoring cached base rootfs"
+    info "Cache hit for base rootfs ($base_key)"
+    cache_restore_base "$base_key"
+    cache_replayed=1
+    mount_target_fs
+    run cp --dereference /etc/resolv.conf "$target"/etc/resolv.conf
+  else
+    # A fresh debootstrap differs from whatever the cached deltas were recorded on
+    replaying=0
+    bootstrap_rootfs
+    cache_save_base "$base_key"
+  fi
+  tmpfs_check "base rootfs"
+
+  step_key="$base_key"
+  recipe_env=()
+  if [[ -v recipes[@] ]]; then
+    collect_recipe_deps
+  fi
+  if (( ${recipe_deps_count:-0} > 0 )); then
+    header "Installing recipe dependencies"
+    info "Declared by ${recipe_deps_count} recipes:"
+    print-array "${recipe_apt_packages[@]}"
+    parent_key="$step_key"
+    step_key="$(cache_deps_key "$(cache_state "$parent_key")")"
+    if [[ "$replaying" == "1" ]] && cache_has "$step_key"; then
+      info "Cache hit for recipe dependencies ($step_key)"
+      cache_restore_step "$step_key"
+      cache_replayed=1
+    else
+      replaying=0
+      cache_begin_step
+      deps_start=$SECONDS
+      run chroot "$target" apt-get update
+      apt_install "${recipe_apt_packages[@]}"
+      recipe_lists_fresh=1
+      info "Recipe dependencies installed in $((SECONDS - deps_start))s"
+      cache_save_step "$step_key" "$parent_key"
+    fi
+    tmpfs_check "recipe dependencies"
+    recipe_env=(CT_RECIPE_DEPS=1)
+  fi
 
   if [[ -v recipes[@] ]]; then
     header "Running installer scripts in chroot"
     while read -r line; do
+      parent_key="$step_key"
+      step_key="$(cache_recipe_key "$(cache_state "$parent_key")" "$line")"
+      # Replay cached deltas up to the first step whose inputs changed
+      if [[ "$replaying" == "1" ]] && cache_has "$step_key"; then
+        info "Cache hit for ${line} ($step_key)"
+        cache_restore_step "$step_key"
+        cache_replayed=1
+        tmpfs_check "$(basename "$line")"
+        continue
+      fi
+      replaying=0
+      cache_begin_step
       info "Running ${line}"
       script_name="$(basename "$line")"
       run cp --archive "$line" "$target/tmp/$script_name"
       run chmod +x "$target/tmp/$script_name"
       if [[ -x "$target/bin/bash" ]]; then
-        run chroot "$target" env DEBIAN_FRONTEND=noninteractive /bin/bash -o pipefail -ec "if [ -d /opt/jdk ]; then export JAVA_HOME=/opt/jdk; else export JAVA_HOME=/tmp/jdk; fi; export LD_LIBRARY_PATH=/opt/jdk/lib:/opt/jdk/lib/jli:/tmp/jdk/lib:/tmp/jdk/lib/jli:\$LD_LIBRARY_PATH; /tmp/$script_name"
+        run chroot "$target" env DEBIAN_FRONTEND=noninteractive "${recipe_env[@]}" /bin/bash -o pipefail -ec "if [ -d /opt/jdk ]; then export JAVA_HOME=/opt/jdk; else export JAVA_HOME=/tmp/jdk; fi; export LD_LIBRARY_PATH=/opt/jdk/lib:/opt/jdk/lib/jli:/tmp/jdk/lib:/tmp/jdk/lib/jli:\$LD_LIBRARY_PATH; /tmp/$script_name"
       else
-        run chroot "$target" env DEBIAN_FRONTEND=noninteractive /bin/sh -ec "if [ -d /opt/jdk ]; then export JAVA_HOME=/opt/jdk; else export JAVA_HOME=/tmp/jdk; fi; export LD_LIBRARY_PATH=/opt/jdk/lib:/opt/jdk/lib/jli:/tmp/jdk/lib:/tmp/jdk/lib/jli:\$LD_LIBRARY_PATH; /tmp/$script_name"
+        run chroot "$target" env DEBIAN_FRONTEND=noninteractive "${recipe_env[@]}" /bin/sh -ec "if [ -d /opt/jdk ]; then export JAVA_HOME=/opt/jdk; else export JAVA_HOME=/tmp/jdk; fi; export LD_LIBRARY_PATH=/opt/jdk/lib:/opt/jdk/lib/jli:/tmp/jdk/lib:/tmp/jdk/lib/jli:\$LD_LIBRARY_PATH; /tmp/$script_name"
       fi
       run rm --force "$target/tmp/$script_name"
+      cache_save_step "$step_key" "$parent_key"
+      tmpfs_check "$script_name"
     done < <(print-array ${recipes[@]})
   fi
 
+  if (( ${#recipe_purge[@]} > 0 )); then
+    header "Purging build-only recipe packages"
+    info "Purging once for ${recipe_purge_count} recipes:"
+    print-array "${recipe_purge[@]}"
+    run chroot "$target" apt-get purge --yes "${recipe_purge[@]}"
+    run chroot "$target" apt-get --yes autoremove
+  fi
+
   header "Apply Docker-specific apt settings"
-  run chroot "$target" apt-get --option Acquire::Check-Valid-Until=false update
+  # The lists are minutes old when the recipe dependency step refreshed them in this build
+  final_update_skipped=0
+  if [[ -n "${recipe_lists_fresh:-}" ]] && compgen -G "$target/var/lib/apt/lists/*_Packages*" >/dev/null; then
+    info "Reusing apt lists from the recipe dependency step; skipping apt-get update"
+    final_update_skipped=1
+  else
+    run chroot "$target" apt-get --option Acquire::Check-Valid-Until=false update
+  fi
+  if [[ -n "${recipe_lists_fresh:-}" ]]; then
+    # Each deferring recipe ran at least one update and install of its own; the merged step costs one of each
+    saved_installs=$(( recipe_gated_count + recipe_guarded_count - 1 ))
+    (( saved_installs > 0 )) || saved_installs=0
+    saved_purges=$(( recipe_gated_purge_count - (${#recipe_purge[@]} > 0 ? 1 : 0) ))
+    (( saved_purges > 0 )) || saved_purges=0
+    info "Recipe dependency savings: at least $((saved_installs + final_update_skipped)) apt-get update," \
+      "${saved_installs} apt-get install and ${saved_purges} apt-get purge runs" \
+      "(of ${recipe_deps_count} recipes, ${recipe_gated_count} skip their apt calls under CT_RECIPE_DEPS" \
+      "and ${recipe_guarded_count} find their guarded prerequisites already installed)"
+  fi
   run chroot "$target" apt-get --yes --quiet upgrade
   echo '#!/bin/sh' > "$target"/usr/sbin/policy-rc.d
   echo 'exit 101' >> "$target"/usr/sbin/policy-rc.d
@@ -517,11 +1109,55 @@ main() {
     done < <(print-array ${scripts[@]})
   fi
 
+  if [[ -n "${tmpfs:-}" ]]; then
+    tmpfs_check "scripts"
+    tmpfs_record_peak
+  fi
+
   header "Archiving image"
-  GZIP="--no-name" run tar --numeric-owner -czf "$dist"/"$name".tar --directory "$target" . --transform='s,^./,,' --mtime='1970-01-01'
-  sha256sum "$dist"/"$name".tar > "$dist"/"$name".sha256
+  # Stream the archive into dist and hash it in the same pass instead of reading it back
+  echo >&2 "$(timestamp) RUN tar --numeric-owner -cz --directory $target . > $dist/$name.tar"
+  GZIP="--no-name" tar --numeric-owner -czf - --directory "$target" . --transform='s,^./,,' --mtime='1970-01-01' \
+    | tee "$dist/$name.tar.partial" | sha256sum | { read -r sum _; echo "$sum  $dist/$name.tar"; } > "$dist/$name.sha256.partial"
+  run mv "$dist/$name.tar.partial" "$dist/$name.tar"
+  run mv "$dist/$name.sha256.partial" "$dist/$name.sha256"
+
+  header "Recording artifact in catalog"
+  if command -v python3 >/dev/null 2>&1; then
+    # Best-effort: the catalog never fails a build
+    python3 "$(cd "$scriptdir/.." && pwd)/scripts/catalog.py" record-build \
+      --tar-file "$dist/$name.tar" --target "$name" \
+      --input "release=$release" --input "variant=$variant" \
+      --input "packages=${packages[*]:-}" --input "recipes=${recipes[*]:-}" \
+      --input "cache_key=${step_key:-$base_key}" || warn "Could not record $name in the artifact catalog"
+  else
+    warn "python3 not found; skipping artifact catalog update"
+  fi
+
+  if [[ "${estargz:-}" == "1" ]]; then
+    header "Exporting eStargz layer"
+    project_root="$(cd "$scriptdir/.." && pwd)"
+    if ! command -v python3 >/dev/null 2>&1; then
+      die "python3 is required for --estargz"
+    fi
+    estargz_args=(--input "$dist/$name.tar" --output "$dist/$name.estargz")
+    if [[ -n "${prioritized_files:-}" ]]; then
+      estargz_args+=(--prioritized-files "$prioritized_files")
+    fi
+    # Prefetch the binaries exercised by the image's structure tests
+    if [[ -f "$project_root/test/$name.yaml" ]]; then
+      estargz_args+=(--test-config "$project_root/test/$name.yaml")
+    fi
+    run python3 "$project_root/scripts/estargz.py" convert "${estargz_args[@]}"
+    run python3 "$project_root/scripts/estargz.py" verify --input "$dist/$name.estargz"
+  fi
+
+  header "Pruning step cache"
+  cache_evict
 
   header "Remove temporary directories"
+  # Unmounting drops an in-memory rootfs at once instead of deleting file by file
+  tmpfs_unmount
   run rm --recursive --force "$target"
   run rm --recursive --force "$debootstrap_dir"
 
@@ -1,4 +1,5 @@
 #!/usr/bin/env bash
+# ct-apt-packages: ca-certificates curl gnupg
 # Install NVIDIA Container Toolkit components inside the Debian rootfs.
 # This enables GPU-aware runtimes and the nvidia-ctk utility inside the image.
 set -euo pipefail
@@ -1,4 +1,5 @@
 #!/usr/bin/env bash
+# ct-apt-packages: ca-certificates curl unzip
 set -o errexit
 set -o pipefail
 
@@ -1,4 +1,5 @@
 #!/usr/bin/env bash
+# ct-apt-packages: ca-certificates curl binutils
 set -euo pipefail
 
 JDK_VERSION="${JAVA_VERSION:-21.0.1}"
@@ -6,10 +7,12 @@ JDK_SHA="${JAVA_SHA:-7e80146b2c3f719bf7f56992eb268ad466f8854d5d6ae11805784608e45
 JDK_URL="${JAVA_URL:-https://download.java.net/java/GA/jdk${JDK_VERSION}/415e3f918a1f4062a0074a2794853d0d/12/GPL/openjdk-${JDK_VERSION}_linux-x64_bin.tar.gz}"
 
 java_slim() {
-    # Ensure necessary tools are available in the chroot
-    apt-get update
-    apt-get install -y --no-install-recommends ca-certificates curl binutils
-    rm -rf /var/lib/apt/lists/*
+    # Ensure necessary tools are available in the chroot (mkimage.sh installs them up front)
+    if [[ -z "${CT_RECIPE_DEPS:-}" ]]; then
+      apt-get update
+      apt-get install -y --no-install-recommends ca-certificates curl binutils
+      rm -rf /var/lib/apt/lists/*
+    fi
 
     # Map Debian arch to JDK archive naming
     arch="$(dpkg --print-architecture)"
@@ -1,4 +1,6 @@
 #!/usr/bin/env bash
+# ct-apt-packages: ca-certificates
+# ct-build-only: curl xz-utils
 set -o errexit
 set -o pipefail
 set -o nounset
@@ -9,12 +11,14 @@ NODE_SHA="${NODE_SHA:-fa9ae28d8796a6cfb7057397e1eea30ca1c61002b42b8897f354563a25
 NODE_URL="${NODE_URL:-https://nodejs.org/dist/v${NODE_VERSION}/node-v${NODE_VERSION}-linux-x64.tar.xz}"
 
 install_nodejs() {
-    echo "==> Installing prerequisites"
-    apt-get update
-    DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends \
-        ca-certificates \
-        curl \
-        xz-utils
+    if [[ -z "${CT_RECIPE_DEPS:-}" ]]; then
+        echo "==> Installing prerequisites"
+        apt-get update
+        DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends \
+            ca-certificates \
+            curl \
+            xz-utils
+    fi
 
     echo "==> Downloading Node.js ${NODE_VERSION}"
     tmp_tar="/tmp/node-v${NODE_VERSION}-linux-x64.tar.xz"
@@ -57,10 +61,14 @@ EOF
     node --version >/dev/null
 
     echo "==> Cleanup"
-    DEBIAN_FRONTEND=noninteractive apt-get purge -y xz-utils curl || true
-    DEBIAN_FRONTEND=noninteractive apt-get autoremove -y
-    apt-get clean
-    rm -rf /var/lib/apt/lists/* "${tmp_tar}"
+    # Under mkimage.sh the build-only packages are purged once after the last recipe
+    if [[ -z "${CT_RECIPE_DEPS:-}" ]]; then
+        DEBIAN_FRONTEND=noninteractive apt-get purge -y xz-utils curl || true
+        DEBIAN_FRONTEND=noninteractive apt-get autoremove -y
+        apt-get clean
+        rm -rf /var/lib/apt/lists/*
+    fi
+    rm -rf "${tmp_tar}"
 }
 
 install_nodejs
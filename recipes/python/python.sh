@@ -1,4 +1,7 @@
 #!/usr/bin/env bash
+# ct-apt-packages: ca-certificates curl xz-utils
+# ct-build-only: build-essential zlib1g-dev libssl-dev libreadline-dev libffi-dev
+# ct-build-only: libbz2-dev libsqlite3-dev liblzma-dev tk-dev
 set -o errexit
 set -o pipefail
 set -o nounset
@@ -10,22 +13,24 @@ PYTHON_SHA="${PYTHON_SHA:-01597db0132c1cf7b331eff68ae09b5a235a3c3caa9c944c29cac7
 PYTHON_URL="${PYTHON_URL:-https://www.python.org/ftp/python/${PYTHON_VERSION}/Python-${PYTHON_VERSION}.tar.xz}"
 
 install_python() {
-    echo "==> Installing build dependencies"
-    apt-get update
-    # Add curl and xz-utils for download/extract; ca-certificates for TLS
-    DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends \
-        build-essential \
-        zlib1g-dev \
-        libssl-dev \
-        libreadline-dev \
-        libffi-dev \
-        libbz2-dev \
-        libsqlite3-dev \
-        liblzma-dev \
-        tk-dev \
-        ca-certificates \
-        curl \
-        xz-utils
+    if [[ -z "${CT_RECIPE_DEPS:-}" ]]; then
+        echo "==> Installing build dependencies"
+        apt-get update
+        # Add curl and xz-utils for download/extract; ca-certificates for TLS
+        DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends \
+            build-essential \
+            zlib1g-dev \
+            libssl-dev \
+            libreadline-dev \
+            libffi-dev \
+            libbz2-dev \
+            libsqlite3-dev \
+            liblzma-dev \
+            tk-dev \
+            ca-certificates \
+            curl \
+            xz-utils
+    fi
 
     echo "==> Downloading Python ${PYTHON_VERSION}"
     tmp_tar="/tmp/Python-${PYTHON_VERSION}.tar.xz"
@@ -68,19 +73,23 @@ install_python() {
     ldconfig
 
     echo "==> Cleaning up build dependencies and caches"
-    DEBIAN_FRONTEND=noninteractive apt-get purge -y \
-        build-essential \
-        zlib1g-dev \
-        libssl-dev \
-        libreadline-dev \
-        libffi-dev \
-        libbz2-dev \
-        libsqlite3-dev \
-        liblzma-dev \
-        tk-dev
-    DEBIAN_FRONTEND=noninteractive apt-get autoremove -y
-    apt-get clean
-    rm -rf /var/lib/apt/lists/* /usr/src/python "${tmp_tar}"
+    # Under mkimage.sh the build-only packages are purged once after the last recipe
+    if [[ -z "${CT_RECIPE_DEPS:-}" ]]; then
+        DEBIAN_FRONTEND=noninteractive apt-get purge -y \
+            build-essential \
+            zlib1g-dev \
+            libssl-dev \
+            libreadline-dev \
+            libffi-dev \
+            libbz2-dev \
+            libsqlite3-dev \
+            liblzma-dev \
+            tk-dev
+        DEBIAN_FRONTEND=noninteractive apt-get autoremove -y
+        apt-get clean
+        rm -rf /var/lib/apt/lists/*
+    fi
+    rm -rf /usr/src/python "${tmp_tar}"
 
     echo "==> Verifying installation"
     if /usr/bin/python3 --version >/dev/null 2>&1; then
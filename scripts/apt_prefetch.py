@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import hashlib
+import lzma
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Ensure local scripts directory is in import path
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from utils import logger, timed
+
+# Index files apt leaves in the chroot after `apt-get update`
+LISTS_DIR = "var/lib/apt/lists"
+DPKG_STATUS = "var/lib/dpkg/status"
+ARCHIVES_DIR = "var/cache/apt/archives"
+
+# Mirror host names contain dots, so the compression is matched on the name, not Path.suffix
+_INDEX_RE = re.compile(r"_Packages(\.gz|\.xz)?$")
+_DEP_RE = re.compile(r"^\s*([^\s:(]+)(?::[a-z0-9-]+)?\s*(?:\(\s*(<<|<=|=|>=|>>|<|>)\s*([^)\s]+)\s*\))?")
+
+
+def _order(c):
+    """Character weight used by dpkg when comparing non-digit version parts."""
+    if c == "~":
+        return -1
+    if not c or c.isdigit():
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _verrevcmp(a, b):
+    """Compare upstream or revision strings exactly like dpkg's verrevcmp()."""
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _order(a[i] if i < len(a) else "")
+            bc = _order(b[j] if j < len(b) else "")
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        while i < len(a) and a[i] == "0":
+            i += 1
+        while j < len(b) and b[j] == "0":
+            j += 1
+        first_diff = 0
+        while i < len(a) and j < len(b) and a[i].isdigit() and b[j].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _split_version(version):
+    epoch, _, rest = version.rpartition(":") if ":" in version else ("0", "", version)
+    upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "")
+    return int(epoch or 0), upstream, revision
+
+
+def compare_versions(a, b):
+    """Return <0, 0 or >0 as Debian version a sorts before, equal to or after b."""
+    ea, ua, ra = _split_version(a)
+    eb, ub, rb = _split_version(b)
+    if ea != eb:
+        return ea - eb
+    return _verrevcmp(ua, ub) or _verrevcmp(ra, rb)
+
+
+def version_satisfies(version, op, wanted):
+    if not op:
+        return True
+    c = compare_versions(version, wanted)
+    return {
+        "<<": c < 0, "<": c <= 0, "<=": c <= 0, "=": c == 0, ">=": c >= 0, ">>": c > 0, ">": c >= 0,
+    }[op]
+
+
+def parse_deb822(text):
+    """Yield stanzas of a Packages/status file as dicts."""
+    stanza = {}
+    key = None
+    for line in text.splitlines():
+        if not line.strip():
+            if stanza:
+                yield stanza
+            stanza, key = {}, None
+        elif line[0] in " \t" and key:
+            stanza[key] += "\n" + line.strip()
+        elif ":" in line:
+            key, _, value = line.partition(":")
+            stanza[key] = value.strip()
+    if stanza:
+        yield stanza
+
+
+def parse_depends(value):
+    """Parse a Depends value into a list of alternative groups of (name, op, version)."""
+    groups = []
+    for group in filter(None, (g.strip() for g in (value or "").split(","))):
+        alternatives = []
+        for alt in group.split("|"):
+            m = _DEP_RE.match(alt)
+            if m:
+                alternatives.append((m.group(1), m.group(2), m.group(3)))
+        if alternatives:
+            groups.append(alternatives)
+    return groups
+
+
+def index_compression(name):
+    """Return the compression suffix of a Packages list name, "" if plain, None if not an index.
+
+    >>> index_compression("deb.debian.org_debian_dists_bullseye_main_binary-amd64_Packages")
+    ''
+    >>> index_compression("deb.debian.org_debian_dists_bullseye_main_binary-amd64_Packages.gz")
+    '.gz'
+    >>> index_compression("deb.debian.org_debian_dists_bullseye_main_binary-amd64_Packages.lz4") is None
+    True
+    """
+    m = _INDEX_RE.search(name)
+    return (m.group(1) or "") if m else None
+
+
+def _read_index(path):
+    data = path.read_bytes()
+    compression = index_compression(path.name)
+    if compression == ".gz":
+        data = gzip.decompress(data)
+    elif compression == ".xz":
+        data = lzma.decompress(data)
+    return data.decode("utf-8", errors="replace")
+
+
+def _uri_to_list_prefix(uri):
+    """Mirror apt's URItoFileName(): drop the scheme, escape '_' and turn '/' into '_'."""
+    parsed = urllib.parse.urlsplit(uri.rstrip("/"))
+    location = (parsed.netloc + parsed.path) if parsed.scheme not in ("file", "copy") else parsed.path
+    return urllib.parse.quote(location, safe="/~:").replace("_", "%5f").replace("/", "_")
+
+
+def read_sources(root):
+    """Return the deb URIs configured in the chroot's sources.list and sources.list.d."""
+    uris = []
+    files = [root / "etc/apt/sources.list"] + sorted((root / "etc/apt/sources.list.d").glob("*.list"))
+    for f in files:
+        if not f.is_file():
+            continue
+        for line in f.read_text().splitlines():
+            parts = re.sub(r"\[[^\]]*\]", "", line).split()
+            if len(parts) >= 2 and parts[0] == "deb" and parts[1] not in uris:
+                uris.append(parts[1])
+    return uris
+
+
+class Repository:
+    """Candidate packages from the Packages indexes and installed packages from dpkg status."""
+
+    def __init__(self, root, arch=None):
+        self.root = Path(root)
+        self.arch = arch or self._detect_arch()
+        self.candidates = {}
+        self.providers = {}
+        self.installed = {}
+        self._load_indexes()
+        self._load_status()
+
+    def _detect_arch(self):
+        arch_file = self.root / "var/lib/dpkg/arch"
+        if arch_file.is_file() and arch_file.read_text().split():
+            return arch_file.read_text().split()[0]
+        for index in sorted((self.root / LISTS_DIR).glob("*_binary-*_Packages*")):
+            return re.search(r"_binary-([^_]+)_Packages", index.name).group(1)
+        if shutil.which("dpkg"):
+            return subprocess.run(["dpkg", "--print-architecture"], stdout=subprocess.PIPE, text=True).stdout.strip()
+        return "amd64"
+
+    def _load_indexes(self):
+        prefixes = {_uri_to_list_prefix(uri): uri.rstrip("/") for uri in read_sources(self.root)}
+        indexes = sorted(p for p in (self.root / LISTS_DIR).glob("*_Packages*") if index_compression(p.name) is not None)
+        if not indexes:
+            raise RuntimeError(f"No Packages indexes under {self.root / LISTS_DIR}; run apt-get update first")
+        for index in indexes:
+            base = next((uri for prefix, uri in prefixes.items() if index.name.startswith(prefix + "_dists_")), None)
+            if base is None:
+                # Fall back to decoding the list name when sources.list is not available
+                location = urllib.parse.unquote(index.name.split("_dists_", 1)[0].replace("_", "/"))
+                base = ("file:" if location.startswith("/") else "http://") + location
+            for stanza in parse_deb822(_read_index(index)):
+                if stanza.get("Architecture") not in (self.arch, "all") or "Filename" not in stanza:
+                    continue
+                stanza["_uri"] = f"{base}/{urllib.parse.quote(stanza['Filename'])}"
+                name = stanza["Package"]
+                current = self.candidates.get(name)
+                if current is None or compare_versions(stanza["Version"], current["Version"]) > 0:
+                    self.candidates[name] = stanza
+        for name, stanza in self.candidates.items():
+            for provided, _, _ in (alt for group in parse_depends(stanza.get("Provides")) for alt in group):
+                self.providers.setdefault(provided, []).append(name)
+
+    def _load_status(self):
+        status = self.root / DPKG_STATUS
+        if not status.is_file():
+            return
+        for stanza in parse_deb822(status.read_text(errors="replace")):
+            if stanza.get("Status", "").endswith(" installed"):
+                self.installed[stanza["Package"]] = stanza["Version"]
+                for provided, _, _ in (alt for group in parse_depends(stanza.get("Provides")) for alt in group):
+                    self.installed.setdefault(provided, None)
+
+    def is_installed(self, name, op=None, version=None):
+        if name not in self.installed:
+            return False
+        installed = self.installed[name]
+        return installed is None and not op or installed is not None and version_satisfies(installed, op, version)
+
+    def candidate(self, name, op=None, version=None):
+        """Return the candidate stanza for a real or virtual package satisfying the constraint."""
+        stanza = self.candidates.get(name)
+        if stanza and version_satisfies(stanza["Version"], op, version):
+            return stanza
+        if not op:
+            for provider in self.providers.get(name, []):
+                return self.candidates[provider]
+        return None
+
+
+def resolve(repo, packages):
+    """Compute the Depends/Pre-Depends closure of packages that is not already installed.
+
+    Returns:
+        List of Packages stanzas to download, in discovery order
+    """
+    selected = {}
+    queue = []
+    for spec in packages:
+        name, _, version = spec.partition("=")
+        stanza = repo.candidate(name, "=" if version else None, version or None)
+        if stanza is None:
+            raise RuntimeError(f"Package {spec} has no installation candidate")
+        queue.append(stanza)
+
+    while queue:
+        stanza = queue.pop(0)
+        if stanza["Package"] in selected:
+            continue
+        selected[stanza["Package"]] = stanza
+        deps = parse_depends(stanza.get("Pre-Depends")) + parse_depends(stanza.get("Depends"))
+        for group in deps:
+            # A group is satisfied if any alternative is installed or already selected
+            if any(
+                repo.is_installed(n, op, v)
+                or (n in selected and version_satisfies(selected[n]["Version"], op, v))
+                or (not op and any(p in selected for p in repo.providers.get(n, [])))
+                for n, op, v in group
+            ):
+                continue
+            chosen = next((c for c in (repo.candidate(n, op, v) for n, op, v in group) if c), None)
+            if chosen is None:
+                alternatives = " | ".join(f"{n} ({op} {v})" if op else n for n, op, v in group)
+                raise RuntimeError(f"Unsatisfiable dependency of {stanza['Package']}: {alternatives}")
+            queue.append(chosen)
+    return list(selected.values())
+
+
+def archive_name(stanza):
+    """File name apt uses in /var/cache/apt/archives (epoch colon escaped as %3a)."""
+    version = stanza["Version"].replace(":", "%3a")
+    return f"{stanza['Package']}_{version}_{stanza['Architecture']}.deb"
+
+
+def _verify(path, stanza):
+    if not path.is_file() or ("Size" in stanza and path.stat().st_size != int(stanza["Size"])):
+        return False
+    if "SHA256" not in stanza:
+        return True
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest() == stanza["SHA256"]
+
+
+def fetch(stanza, archives, retries=3, timeout=60):
+    """Download one .deb into archives/, resuming partial downloads and verifying SHA256.
+
+    Returns:
+        Path to the verified .deb
+    """
+    final = archives / archive_name(stanza)
+    if _verify(final, stanza):
+        logger.debug(f"Already downloaded: {final.name}")
+        return final
+    partial = archives / "partial" / final.name
+    partial.parent.mkdir(parents=True, exist_ok=True)
+
+    for attempt in range(1, retries + 1):
+        try:
+            offset = partial.stat().st_size if partial.exists() else 0
+            request = urllib.request.Request(stanza["_uri"])
+            if offset and stanza["_uri"].startswith(("http://", "https://")):
+                request.add_header("Range", f"bytes={offset}-")
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                # Servers that ignore Range (and file: URLs) send the whole file again
+                resumed = offset and getattr(response, "status", 200) == 206
+                with open(partial, "ab" if resumed else "wb") as out:
+                    shutil.copyfileobj(response, out, 1024 * 1024)
+            if _verify(partial, stanza):
+                os.replace(partial, final)
+                return final
+            logger.warning(f"Hash mismatch for {final.name} (attempt {attempt}/{retries}); discarding")
+            partial.unlink()
+        except (OSError, urllib.error.URLError) as e:
+            logger.warning(f"Download of {final.name} failed (attempt {attempt}/{retries}): {e}")
+        if attempt < retries:
+            time.sleep(min(2 ** (attempt - 1), 8))
+    raise RuntimeError(f"Could not download {stanza['_uri']}")
+
+
+def prefetch(root, packages, jobs=8, arch=None):
+    """Resolve packages inside a chroot and download the missing .debs into its apt archive.
+
+    Args:
+        root: Path to the chroot (mkimage.sh target)
+        packages: Package names, optionally pinned as name=version
+        jobs: Number of concurrent downloads
+        arch: Debian architecture (default: detected from the chroot)
+
+    Returns:
+        List of paths of downloaded .deb files
+    """
+    repo = Repository(root, arch)
+    closure = resolve(repo, packages)
+    total = sum(int(s.get("Size", 0)) for s in closure)
+    logger.info(f"Resolved {len(packages)} requested packages to {len(closure)} .debs ({total / 1e6:.1f} MB)")
+    archives = Path(root) / ARCHIVES_DIR
+    archives.mkdir(parents=True, exist_ok=True)
+    with timed("download", nbytes=total), ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        files = list(pool.map(fetch, closure, [archives] * len(closure)))
+    logger.info(f"Downloaded and verified {len(files)} .debs into {archives}")
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Resolve package dependencies from a chroot's apt indexes and download the .debs in parallel."
+    )
+    parser.add_argument("--root", required=True, help="Chroot directory with apt lists (after apt-get update).")
+    parser.add_argument("--packages", required=True, help="Comma- or space-separated packages (name or name=version).")
+    parser.add_argument("--jobs", type=int, default=8, help="Concurrent downloads (default: 8).")
+    parser.add_argument("--arch", help="Debian architecture (default: detected from the chroot).")
+    parser.add_argument("--print-uris", action="store_true", help="Only print the resolved URIs, sizes and hashes.")
+    args = parser.parse_args()
+
+    packages = [p for p in re.split(r"[,\s]+", args.packages) if p]
+    try:
+        if args.print_uris:
+            for stanza in resolve(Repository(args.root, args.arch), packages):
+                print(f"{stanza['_uri']} {archive_name(stanza)} {stanza.get('Size', '')} SHA256:{stanza.get('SHA256', '')}")
+        else:
+            prefetch(args.root, packages, args.jobs, args.arch)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
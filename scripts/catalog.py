@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tarfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Ensure local scripts directory is in import path
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from utils import logger
+
+# Default catalog location, next to the mkimage.sh artifacts (override with CT_CATALOG)
+DEFAULT_CATALOG = Path(__file__).resolve().parent.parent / "debian" / "dist" / "catalog.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    sha256 TEXT,
+    archive_type TEXT,
+    build_inputs TEXT,
+    built_at REAL,
+    gpg_signed_at REAL,
+    gpg_verified_at REAL,
+    gpg_verified INTEGER,
+    cosign_signed_at REAL,
+    cosign_verified_at REAL,
+    cosign_verified INTEGER,
+    tested_at REAL,
+    test_passed INTEGER,
+    test_config TEXT
+);
+CREATE INDEX IF NOT EXISTS artifacts_target ON artifacts (target);
+"""
+
+# Named queries for `catalog.py list`
+QUERIES = {
+    "all": "1",
+    "unsigned": "gpg_signed_at IS NULL AND cosign_signed_at IS NULL",
+    "unsigned-gpg": "gpg_signed_at IS NULL",
+    "unsigned-cosign": "cosign_signed_at IS NULL",
+    "unverified": "(gpg_signed_at IS NOT NULL AND COALESCE(gpg_verified, 0) = 0)"
+                  " OR (cosign_signed_at IS NOT NULL AND COALESCE(cosign_verified, 0) = 0)",
+    "untested": "tested_at IS NULL OR tested_at < built_at",
+    "failed-tests": "test_passed = 0 AND tested_at >= built_at",
+}
+
+def catalog_path(path=None):
+    """Return the catalog database path (argument, CT_CATALOG, or the default under debian/dist)."""
+    return Path(path or os.environ.get("CT_CATALOG") or DEFAULT_CATALOG)
+
+def _hand_to_sudo_user(db):
+    """Give the catalog to the user behind sudo, since mkimage.sh records builds as root."""
+    uid, gid = os.environ.get("SUDO_UID"), os.environ.get("SUDO_GID")
+    if os.geteuid() != 0 or not uid:
+        return
+    # WAL mode creates -wal/-shm files next to the database, so the directory must be writable too
+    for path in (db.parent, db, Path(f"{db}-wal"), Path(f"{db}-shm")):
+        try:
+            os.chown(path, int(uid), int(gid or -1))
+        except OSError:
+            pass
+
+def _connect_readonly(db):
+    """Open an existing catalog without writing to it; a missing one reads as empty."""
+    if not db.exists():
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA)
+        return conn
+    uri = db.resolve().as_uri()
+    conn = sqlite3.connect(f"{uri}?mode=ro", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("SELECT 1 FROM artifacts LIMIT 1")
+        return conn
+    except sqlite3.OperationalError:
+        conn.close()
+    # Reading a WAL database needs a writable -shm file; without one, read the main file
+    # as immutable (changes not yet checkpointed by a running build are not visible)
+    conn = sqlite3.connect(f"{uri}?mode=ro&immutable=1", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("SELECT 1 FROM artifacts LIMIT 1")
+    return conn
+
+def connect(path=None, readonly=False):
+    """Open the catalog, creating the schema on first use.
+
+    With readonly, queries also work on a catalog the caller cannot write
+    (e.g. one created by a sudo build before ownership was handed back).
+    """
+    db = catalog_path(path)
+    if readonly:
+        return _connect_readonly(db)
+    db.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    _hand_to_sudo_user(db)
+    return conn
+
+def snapshot(conn):
+    """Copy a catalog into memory so it can be updated without touching the file."""
+    copy = sqlite3.connect(":memory:")
+    copy.row_factory = sqlite3.Row
+    conn.backup(copy)
+    return copy
+
+@contextmanager
+def session(path=None, readonly=False):
+    """Yield a connection that commits on success and is always closed."""
+    conn = connect(path, readonly)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _key(tar_file):
+    return str(Path(tar_file).resolve())
+
+def _target_of(tar_file):
+    return Path(tar_file).stem
+
+def _fresh_sidecar_sha256(tar_file):
+    """Return the digest from mkimage's <name>.sha256 if it is newer than the tarball."""
+    sum_file = Path(tar_file).with_suffix(".sha256")
+    try:
+        if sum_file.stat().st_mtime >= Path(tar_file).stat().st_mtime:
+            fields = sum_file.read_text().split()
+            if fields and len(fields[0]) == 64:
+                return fields[0]
+    except OSError:
+        pass
+    return None
+
+def _detect_archive_type(tar_file):
+    """Classify a tarball as oci-archive, docker-archive or rootfs by its top-level entries."""
+    try:
+        with tarfile.open(tar_file, "r:*") as tf:
+            names = set()
+            for member in tf:
+                names.add(member.name.lstrip("./"))
+                if len(names) > 64:
+                    break
+        if "index.json" in names and "oci-layout" in names:
+            return "oci-archive"
+        if "manifest.json" in names:
+            return "docker-archive"
+    except (OSError, tarfile.TarError):
+        return None
+    return "rootfs"
+
+def _upsert(conn, tar_file, **fields):
+    """Insert the artifact row if missing, then update the given columns.
+
+    New rows get size, mtime and built_at from the file so check() has a baseline
+    even when the first event for an artifact is a signature or verification.
+    """
+    key = _key(tar_file)
+    try:
+        st = Path(tar_file).stat()
+        size, mtime = st.st_size, st.st_mtime
+    except OSError:
+        size = mtime = None
+    conn.execute(
+        "INSERT OR IGNORE INTO artifacts (path, target, size, mtime, built_at) VALUES (?, ?, ?, ?, ?)",
+        (key, _target_of(tar_file), size, mtime, mtime),
+    )
+    if fields:
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE artifacts SET {columns} WHERE path = ?", (*fields.values(), key))
+
+def _best_effort(func):
+    """Catalog updates must never break the tool that reports them."""
+    def wrapper(*args, **kwargs):
+        try:
+            with session() as conn:
+                return func(conn, *args, **kwargs)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Could not update artifact catalog {catalog_path()}: {e}")
+            return None
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+def _stat_fields(tar_file):
+    st = Path(tar_file).stat()
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+@_best_effort
+def record_build(conn, tar_file, target=None, inputs=None, sha256=None):
+    """Record a freshly built artifact; signature, verification and test state are reset."""
+    _upsert(
+        conn,
+        tar_file,
+        target=target or _target_of(tar_file),
+        sha256=sha256 or _fresh_sidecar_sha256(tar_file),
+        archive_type=_detect_archive_type(tar_file),
+        build_inputs=json.dumps(inputs or {}, sort_keys=True),
+        built_at=time.time(),
+        gpg_signed_at=None, gpg_verified_at=None, gpg_verified=None,
+        cosign_signed_at=None, cosign_verified_at=None, cosign_verified=None,
+        tested_at=None, test_passed=None, test_config=None,
+        **_stat_fields(tar_file),
+    )
+
+@_best_effort
+def record_signature(conn, tar_file, kind):
+    """Record that an artifact was signed with gpg or cosign."""
+    _upsert(conn, tar_file, **{f"{kind}_signed_at": time.time()})
+
+@_best_effort
+def record_verification(conn, tar_file, kind, ok):
+    """Record the outcome of a gpg or cosign verification."""
+    _upsert(conn, tar_file, **{f"{kind}_verified_at": time.time(), f"{kind}_verified": int(bool(ok))})
+
+@_best_effort
+def record_archive_type(conn, tar_file, archive_type):
+    """Record the archive type detected while importing an artifact."""
+    _upsert(conn, tar_file, archive_type=archive_type)
+
+@_best_effort
+def record_test(conn, target, passed, config=None):
+    """Record a container-structure-test verdict for every artifact of a target (image name)."""
+    target = target.split("@", 1)[0].rsplit("/", 1)[-1].split(":", 1)[0]
+    conn.execute(
+        "UPDATE artifacts SET tested_at = ?, test_passed = ?, test_config = ? WHERE target = ?",
+        (time.time(), int(bool(passed)), str(config) if config else None, target),
+    )
+
+def scan(conn, directory):
+    """Add tarballs under directory that are not catalogued yet (no hashing; uses fresh .sha256 sidecars).
+
+    Rows missing their file metadata (size, mtime, built_at, sha256, archive type) are completed.
+    """
+    known = {row["path"]: row for row in conn.execute("SELECT path, size, mtime, built_at, sha256, archive_type FROM artifacts")}
+    added = 0
+    for tar_file in Path(directory).rglob("*.tar"):
+        row = known.get(_key(tar_file))
+        if row is not None and None not in (row["size"], row["mtime"], row["built_at"]):
+            continue
+        fields = _stat_fields(tar_file)
+        if row is None or row["built_at"] is None:
+            fields["built_at"] = fields["mtime"]
+        if row is None or row["sha256"] is None:
+            fields["sha256"] = _fresh_sidecar_sha256(tar_file)
+        if row is None or row["archive_type"] is None:
+            fields["archive_type"] = _detect_archive_type(tar_file)
+        _upsert(conn, tar_file, **fields)
+        added += 1
+    return added
+
+def query(conn, name="all", target=None, existing=False):
+    """Return catalog rows matching a named query from QUERIES.
+
+    With existing, rows whose file is gone are left out.
+    """
+    sql = f"SELECT * FROM artifacts WHERE ({QUERIES[name]})"
+    params = []
+    if target:
+        sql += " AND target = ?"
+        params.append(target)
+    rows = conn.execute(sql + " ORDER BY target, path", params)
+    return [row for row in rows if not existing or Path(row["path"]).exists()]
+
+def check(conn, prune=False):
+    """Find rows whose file is missing or changed since it was recorded.
+
+    Returns:
+        List of (path, problem) tuples
+    """
+    stale = []
+    for row in conn.execute("SELECT path, size, mtime FROM artifacts"):
+        path = Path(row["path"])
+        if not path.exists():
+            stale.append((row["path"], "missing"))
+        else:
+            st = path.stat()
+            if st.st_size != row["size"] or st.st_mtime != row["mtime"]:
+                stale.append((row["path"], "changed since recorded"))
+    if prune and stale:
+        conn.executemany("DELETE FROM artifacts WHERE path = ?", [(p,) for p, _ in stale])
+    return stale
+
+def print_rows(rows, args):
+    """Print list results as JSON, selected fields or a table."""
+    if args.json:
+        print(json.dumps([dict(r) for r in rows], indent=2))
+    elif args.field:
+        for row in rows:
+            print(" ".join(str(row[f]) for f in args.field.split(",")))
+    else:
+        for row in rows:
+            print(f"{row['target']:<32} {row['archive_type'] or '-':<15} {row['path']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and maintain the SQLite catalog of built artifacts.")
+    parser.add_argument("--catalog", help=f"Catalog database (default: $CT_CATALOG or {DEFAULT_CATALOG}).")
+    sub = parser.add_subparsers(dest="command")
+
+    build = sub.add_parser("record-build", help="Record a freshly built artifact (called by mkimage.sh).")
+    build.add_argument("--tar-file", required=True, help="Path to the built tarball.")
+    build.add_argument("--target", help="Build target name (default: tarball stem).")
+    build.add_argument("--input", action="append", default=[], metavar="KEY=VALUE", help="Build input to record (repeatable).")
+
+    scan_p = sub.add_parser("scan", help="Add uncatalogued tarballs found under a directory.")
+    scan_p.add_argument("directory", help="Directory to scan (e.g. debian/dist).")
+
+    list_p = sub.add_parser("list", help="List artifacts matching a query.")
+    list_p.add_argument("query", nargs="?", default="all", choices=sorted(QUERIES), help="Named query (default: all).")
+    list_p.add_argument("--target", help="Restrict to one build target.")
+    list_p.add_argument("--field", help="Print only these comma-separated columns, one row per line (e.g. target,path).")
+    list_p.add_argument("--json", action="store_true", help="Print rows as JSON.")
+    list_p.add_argument("--scan", metavar="DIRECTORY", help="Scan a directory first; kept in memory if the catalog is not writable.")
+    list_p.add_argument("--existing", action="store_true", help="Skip rows whose file no longer exists.")
+
+    check_p = sub.add_parser("check", help="Detect stale rows whose artifact is missing or changed.")
+    check_p.add_argument("--prune", action="store_true", help="Delete stale rows.")
+
+    args = parser.parse_args()
+
+    # Show help if no subcommand is provided
+    if not args.command:
+        parser.print_help()
+        return
+
+    if args.catalog:
+        os.environ["CT_CATALOG"] = args.catalog
+
+    if args.command == "record-build":
+        inputs = dict(item.split("=", 1) for item in args.input if "=" in item)
+        record_build(args.tar_file, args.target, inputs)
+        logger.info(f"Recorded build of {args.tar_file} in {catalog_path()}")
+        return
+
+    if args.command == "list" and args.scan:
+        try:
+            with session() as conn:
+                scan(conn, args.scan)
+        except (sqlite3.OperationalError, OSError) as e:
+            logger.warning(f"Catalog {catalog_path()} is not writable ({e}); scanning {args.scan} in memory")
+            with session(readonly=True) as conn:
+                memory = snapshot(conn)
+            scan(memory, args.scan)
+            print_rows(query(memory, args.query, args.target, args.existing), args)
+            return
+
+    # Only scan and check --prune write; everything else reads, even from a root-owned catalog
+    readonly = args.command == "list" or (args.command == "check" and not args.prune)
+    try:
+        with session(readonly=readonly) as conn:
+            if args.command == "scan":
+                logger.info(f"Added or completed {scan(conn, args.directory)} artifacts in {catalog_path()}")
+            elif args.command == "list":
+                print_rows(query(conn, args.query, args.target, args.existing), args)
+            elif args.command == "check":
+                stale = check(conn, args.prune)
+                for path, problem in stale:
+                    logger.warning(f"Stale catalog row ({problem}): {path}")
+                if stale and not args.prune:
+                    sys.exit(1)
+                logger.info(f"Catalog check complete: {len(stale)} stale rows{' pruned' if args.prune and stale else ''}")
+    except sqlite3.OperationalError as e:
+        if readonly:
+            raise
+        logger.error(f"Cannot update catalog {catalog_path()}: {e} (fix its ownership or rerun with sudo)")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
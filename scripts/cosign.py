@@ -3,11 +3,20 @@
 import os
 import subprocess
 import argparse
+import fcntl
+import hashlib
+import json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Import common utilities
-from utils import logger, run_command, find_tar_files, check_program_installed
+from utils import logger, run_command, find_tar_files, check_program_installed, timed, timed_command
+from catalog import record_signature, record_verification
+
+# Default location of the positive verification cache
+DEFAULT_VERIFY_CACHE = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "container-tools" / "cosign-verify.json"
 
 def is_docker_archive(tar_file):
     """Check if the tar file is a Docker archive (created with docker save)."""
@@ -56,7 +65,11 @@ def sign_image(tar_file, key=None, registry=None, dry_run=False, oci_ref_type="o
                 run_command(f"docker import {tar_file} {final_tag}", dry_run=dry_run)
 
             logger.info(f"Pushing image: {final_tag}")
-            run_command(f"docker push {final_tag}", dry_run=dry_run)
+            with timed("push") as phase:
+                _, stderr, rc = run_command(f"docker push {final_tag}", dry_run=dry_run, return_code=True)
+                if rc != 0:
+                    phase.fail()
+                    raise Exception(f"docker push failed: {stderr.strip()}")
 
             # Determine repo@digest from Docker
             logger.info(f"Getting repo digest for: {final_tag}")
@@ -91,13 +104,32 @@ def sign_image(tar_file, key=None, registry=None, dry_run=False, oci_ref_type="o
             logger.warning("Using keyless signing. Ensure COSIGN_EXPERIMENTAL=1 is set.")
             sign_cmd = f"cosign sign {sign_reference}"
 
-        run_command(sign_cmd, dry_run=dry_run)
+        nbytes = Path(tar_file).stat().st_size if Path(tar_file).is_file() else 0
+        with timed("sign", nbytes=nbytes) as phase:
+            _, stderr, rc = run_command(sign_cmd, dry_run=dry_run, return_code=True)
+            if rc != 0:
+                phase.fail()
+                raise Exception(f"cosign sign failed: {stderr.strip()}")
         logger.info(f"Successfully signed: {sign_reference}")
+        if not dry_run and Path(tar_file).is_file():
+            record_signature(tar_file, "cosign")
 
     except Exception as e:
         logger.error(f"Failed to sign image: {tar_file}. Error: {e}")
         raise
 
+def _cosign_verify(reference, key=None):
+    """Run cosign verify for one reference and return (ok, stdout, stderr)."""
+    cmd = ["cosign", "verify"]
+    if key:
+        cmd.extend(["--key", key])
+    cmd.append(reference)
+    with timed_command("cosign") as cmd_metrics:
+        result = subprocess.run(cmd, check=False, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            cmd_metrics.fail()
+    return result.returncode == 0, result.stdout.strip(), result.stderr.strip()
+
 def verify_image(reference, key=None, dry_run=False):
     """Verify a signed image reference using cosign.
 
@@ -106,18 +138,191 @@ def verify_image(reference, key=None, dry_run=False):
       - repo@sha256:<digest>
       - ocidir:/path/to/oci-layout
       - oci-archive:/path/to/image.tar
+
+    Returns True when cosign accepted the signature.
     """
     if not reference:
         raise Exception("Verification requires a non-empty reference")
 
     logger.info(f"Verifying reference: {reference}")
-    verify_cmd = f"cosign verify {'--key '+key+' ' if key else ''}{reference}"
-    stdout, stderr = run_command(verify_cmd, dry_run=dry_run)
+    if dry_run:
+        logger.info(f"[Dry Run] Skipping execution of: cosign verify {'--key '+key+' ' if key else ''}{reference}")
+        return True
+    with timed("verify") as phase:
+        ok, stdout, stderr = _cosign_verify(reference, key)
+        if not ok:
+            phase.fail()
     if stdout:
         logger.info(f"Cosign verify output:\n{stdout}")
     if stderr:
         logger.warning(f"Cosign verify warnings:\n{stderr}")
-    logger.info("Verification completed.")
+    if ok:
+        logger.info("Verification completed.")
+    else:
+        logger.error(f"Verification failed: {reference}")
+    return ok
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    return f"sha256:{digest.hexdigest()}"
+
+def _sha256_tree(path):
+    """Hash every file of an OCI layout directory (relative paths and contents)."""
+    digest = hashlib.sha256()
+    for file in sorted(p for p in Path(path).rglob("*") if p.is_file()):
+        digest.update(f"{file.relative_to(path)}\0{_sha256_file(file)}\0".encode())
+    return f"sha256:{digest.hexdigest()}"
+
+def resolve_digest(reference):
+    """Resolve a reference to the content digest used as the cache key, or None if unknown.
+
+    - repo@sha256:... uses the pinned digest
+    - oci-archive:/ocidir: hash the archive file or the whole layout directory; the digest that
+      index.json claims is not trusted, since a tampered archive can keep the same index.json
+    - repo:tag is resolved through the registry with `cosign triangulate`, since tags are mutable
+    """
+    try:
+        if reference.startswith("oci-archive:"):
+            return _sha256_file(Path(reference.split(":", 1)[1]))
+        if reference.startswith("ocidir:"):
+            return _sha256_tree(Path(reference.split(":", 1)[1]))
+        if "@sha256:" in reference:
+            return reference.split("@", 1)[1]
+        result = subprocess.run(
+            ["cosign", "triangulate", reference], check=False, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        # Output looks like repo:sha256-<hex>.sig
+        tag = result.stdout.strip().rsplit(":", 1)[-1]
+        if result.returncode == 0 and tag.startswith("sha256-") and tag.endswith(".sig"):
+            return "sha256:" + tag[len("sha256-"):-len(".sig")]
+    except (OSError, ValueError) as e:
+        logger.debug(f"Could not resolve digest for {reference}: {e}")
+    return None
+
+def pin_reference(reference, digest):
+    """Turn a registry repo:tag into repo@digest, so cosign checks the image that was resolved.
+
+    Local layouts and references that already carry a digest are returned unchanged.
+    """
+    if not digest or reference.startswith(("oci-archive:", "ocidir:")) or "@" in reference:
+        return reference
+    repo, _, last = reference.rpartition("/")
+    name = last.split(":", 1)[0]
+    return f"{repo}/{name}@{digest}" if repo else f"{name}@{digest}"
+
+def key_identity(key=None):
+    """Identify the verification key: a hash of a key file, the key URI itself, or keyless."""
+    if not key:
+        return "keyless"
+    if os.path.isfile(key):
+        return _sha256_file(key)
+    return key
+
+class VerifyCache:
+    """Positive verification results keyed by digest and key identity, with a TTL."""
+
+    def __init__(self, path=DEFAULT_VERIFY_CACHE, ttl=3600):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.entries = {}
+        if ttl > 0 and self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except ValueError:
+                logger.warning(f"Ignoring unreadable verification cache: {self.path}")
+
+    @staticmethod
+    def key(digest, identity):
+        return f"{digest}|{identity}"
+
+    def get(self, digest, identity):
+        """Return True if the digest was verified with this key within the TTL."""
+        if self.ttl <= 0 or not digest:
+            return False
+        verified_at = self.entries.get(self.key(digest, identity))
+        return verified_at is not None and time.time() - verified_at < self.ttl
+
+    def put(self, digest, identity):
+        if self.ttl > 0 and digest:
+            self.entries[self.key(digest, identity)] = time.time()
+
+    def save(self):
+        """Persist unexpired entries, merging with concurrent writers under a file lock."""
+        if self.ttl <= 0:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f".{self.path.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = {}
+            if self.path.exists():
+                try:
+                    merged = json.loads(self.path.read_text())
+                except ValueError:
+                    merged = {}
+            merged.update(self.entries)
+            now = time.time()
+            merged = {k: v for k, v in merged.items() if now - v < self.ttl}
+            tmp = self.path.with_name(f".{self.path.name}.tmp")
+            tmp.write_text(json.dumps(merged, indent=2) + "\n")
+            os.replace(tmp, self.path)
+
+def verify_images(references, key=None, jobs=4, cache=None, dry_run=False):
+    """Verify many references concurrently, skipping digests verified within the cache TTL.
+
+    Args:
+        references: Image references (same forms as verify_image)
+        key: Public key, KMS URI or None for keyless
+        jobs: Maximum number of concurrent cosign processes
+        cache: VerifyCache instance (optional)
+        dry_run: If True, only log the commands
+
+    Returns:
+        List of per-reference result dicts, in input order
+    """
+    identity = key_identity(key)
+
+    def verify_one(reference):
+        start = time.perf_counter()
+        result = {"reference": reference, "digest": None, "verified": False, "cached": False, "error": None}
+        try:
+            result["digest"] = resolve_digest(reference)
+            # A tag can move after triangulate; verifying the digest keeps the cache entry honest
+            target = pin_reference(reference, result["digest"])
+            if cache and cache.get(result["digest"], identity):
+                logger.info(f"Cached verification for {reference} ({result['digest']})")
+                result["verified"] = result["cached"] = True
+            elif dry_run:
+                logger.info(f"[Dry Run] Skipping execution of: cosign verify {target}")
+                result["verified"] = True
+            else:
+                with timed("verify") as phase:
+                    ok, stdout, stderr = _cosign_verify(target, key)
+                    if not ok:
+                        phase.fail()
+                result["verified"] = ok
+                if ok:
+                    logger.info(f"Verified: {reference}")
+                    if cache:
+                        cache.put(result["digest"], identity)
+                else:
+                    result["error"] = stderr or stdout
+                    logger.error(f"Verification failed: {reference}: {result['error']}")
+        except Exception as e:
+            result["error"] = str(e)
+            logger.error(f"Verification failed: {reference}: {e}")
+        result["duration"] = round(time.perf_counter() - start, 3)
+        if not dry_run and reference.startswith("oci-archive:"):
+            record_verification(reference.split(":", 1)[1], "cosign", result["verified"])
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(verify_one, references))
+    if cache and not dry_run:
+        cache.save()
+    return results
 
 def main():
     parser = argparse.ArgumentParser(description="Sign tar archive images using cosign.")
@@ -144,7 +349,30 @@ def main():
     )
     parser.add_argument(
         "--reference",
-        help="Image reference to verify (repo:tag, repo@digest, ocidir:/path, or oci-archive:/path).",
+        action="append",
+        help="Image reference to verify (repo:tag, repo@digest, ocidir:/path, or oci-archive:/path). "
+        "Repeat to verify several; without it, --verify checks every tar in --directory as oci-archive:.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Number of concurrent verifications (default: 4).",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=3600,
+        help="Seconds to trust a previous successful verification of the same digest and key (0 disables).",
+    )
+    parser.add_argument(
+        "--cache-file",
+        default=str(DEFAULT_VERIFY_CACHE),
+        help=f"Verification cache location (default: {DEFAULT_VERIFY_CACHE}).",
+    )
+    parser.add_argument(
+        "--report",
+        help="Write a JSON report with one entry per verified reference ('-' for stdout).",
     )
     parser.add_argument(
         "--oci-ref-type",
@@ -167,10 +395,25 @@ def main():
 
     # Verification mode
     if args.verify:
-        if not args.reference:
+        references = args.reference or [f"oci-archive:{t}" for t in find_tar_files(args.directory)]
+        if not references:
             logger.error("Verification requires --reference set to repo:tag, repo@digest, ocidir:/path or oci-archive:/path.")
             exit(1)
-        verify_image(args.reference, args.key, args.dry_run)
+        cache = VerifyCache(args.cache_file, args.cache_ttl)
+        results = verify_images(references, args.key, args.jobs, cache, args.dry_run)
+        failed = [r for r in results if not r["verified"]]
+        logger.info(
+            f"Verified {len(results) - len(failed)}/{len(results)} references "
+            f"({sum(r['cached'] for r in results)} from cache)."
+        )
+        if args.report:
+            report = json.dumps({"results": results, "failed": len(failed)}, indent=2)
+            if args.report == "-":
+                print(report)
+            else:
+                Path(args.report).write_text(report + "\n")
+        if failed:
+            exit(1)
         return
 
     # Signing mode
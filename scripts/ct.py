@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Ensure local scripts directory is in import path
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from utils import logger, find_tar_files, check_program_installed
+
+# Subcommand modules (gpg, cosign, import_and_sign, test, catalog) are imported inside the
+# handlers so each invocation only pays for the tools it actually uses.
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+TEST_CONFIG_DIR = SCRIPTS_DIR.parent / "test"
+PIPELINE_STAGES = ("import", "sign", "verify", "test")
+
+INSTALL_URLS = {
+    "gpg": "https://gnupg.org/download/",
+    "cosign": "https://docs.sigstore.dev/cosign/installation/",
+    "docker": "https://docs.docker.com/get-docker/",
+    "skopeo": "https://github.com/containers/skopeo",
+    "container-structure-test": "https://github.com/GoogleContainerTools/container-structure-test",
+}
+
+def require(*programs):
+    """Raise if any required program is missing (lookups are cached in-process).
+
+    Raising fails only the current artifact's stage; run_stages carries on with the next one.
+    """
+    missing = [p for p in programs if not check_program_installed(p, INSTALL_URLS.get(p))]
+    if missing:
+        raise RuntimeError(f"required program(s) not installed: {', '.join(missing)}")
+
+def in_github_actions():
+    return os.environ.get("GITHUB_ACTIONS") == "true"
+
+def collect_artifacts(args):
+    """Build the shared metadata for every selected tarball.
+
+    Each artifact is a dict that stages read and extend (archive_type, image, config, ...),
+    so the archive is inspected once no matter how many stages run.
+    """
+    paths = [Path(p) for p in (args.tar_file or [])]
+    if getattr(args, "query", None):
+        from catalog import session, query
+
+        with session(readonly=True) as conn:
+            matched = [Path(row["path"]) for row in query(conn, args.query)]
+        if not matched:
+            logger.info(f"No catalogued artifacts match query '{args.query}'")
+        paths.extend(matched)
+    # --directory is the default source only; an empty query means there is nothing to do
+    elif not paths:
+        paths = find_tar_files(args.directory)
+    artifacts = []
+    for path in paths:
+        target = path.stem
+        artifacts.append({
+            "path": path,
+            "target": target,
+            "image": getattr(args, "image_name", None) or f"{target}:latest",
+            "config": TEST_CONFIG_DIR / f"{target}.yaml",
+        })
+    return artifacts
+
+def stage_import(artifact, args):
+    from import_and_sign import detect_archive_type, import_image
+
+    if "archive_type" not in artifact:
+        artifact["archive_type"] = detect_archive_type(artifact["path"])
+    require("skopeo" if artifact["archive_type"] in ("oci-archive", "docker-archive") else "docker")
+    return import_image(artifact["path"], artifact["image"], transport=artifact["archive_type"], dry_run=args.dry_run)
+
+def stage_sign(artifact, args):
+    if in_github_actions():
+        logger.info("Detected GitHub Actions; skipping signing in CI.")
+        return True
+    if args.cosign:
+        from cosign import sign_image
+
+        require("cosign")
+        sign_image(artifact["path"], args.cosign_key, None, args.dry_run)
+    if args.gpg_key_id:
+        from gpg import sign_tarball_with_gpg
+
+        require("gpg")
+        sign_tarball_with_gpg(artifact["path"], args.gpg_key_id, args.passphrase, args.dry_run, force=True)
+    if not args.cosign and not args.gpg_key_id:
+        logger.info(f"No --gpg-key-id or --cosign given; not signing {artifact['path']}")
+    return True
+
+def stage_verify(artifact, args):
+    ok = True
+    if args.cosign:
+        from cosign import VerifyCache, verify_images
+
+        require("cosign")
+        cache = VerifyCache(ttl=args.cache_ttl)
+        result = verify_images([f"oci-archive:{artifact['path']}"], args.cosign_key, 1, cache, args.dry_run)[0]
+        ok = ok and result["verified"]
+    sig_file = Path(f"{artifact['path']}.asc")
+    if sig_file.exists():
+        from gpg import verify_tarball_with_gpg
+
+        require("gpg")
+        ok = ok and verify_tarball_with_gpg(artifact["path"], sig_file, args.dry_run) is not False
+    elif not args.cosign:
+        logger.info(f"No signature to verify for {artifact['path']}")
+    return ok
+
+def stage_test(artifact, args):
+    config = Path(args.config) if getattr(args, "config", None) else artifact["config"]
+    if not config.is_file():
+        logger.info(f"No test config found for image: {artifact['target']}")
+        return True
+    from test import run_container_test, validate_config_file
+
+    require("container-structure-test")
+    if not validate_config_file(config):
+        return False
+    run_container_test(artifact["image"], config, dry_run=args.dry_run)
+    return True
+
+STAGE_HANDLERS = {
+    "import": stage_import,
+    "sign": stage_sign,
+    "verify": stage_verify,
+    "test": stage_test,
+}
+
+def run_stages(stages, args):
+    """Run the stages in order for every artifact; one artifact failing does not stop the others."""
+    artifacts = collect_artifacts(args)
+    if not artifacts:
+        logger.info("No .tar files found. Exiting.")
+        return 0
+    failed = 0
+    for artifact in artifacts:
+        for stage in stages:
+            logger.info(f"[{stage}] {artifact['path']}")
+            try:
+                ok = STAGE_HANDLERS[stage](artifact, args)
+            except Exception as e:
+                logger.error(f"[{stage}] failed for {artifact['path']}: {e}")
+                ok = False
+            if not ok:
+                failed += 1
+                logger.error(f"Stopping pipeline for {artifact['path']} after failed stage: {stage}")
+                break
+    logger.info(f"Processed {len(artifacts)} artifacts, {failed} failed.")
+    return 1 if failed else 0
+
+def parse_stages(value):
+    stages = [s.strip() for s in value.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in PIPELINE_STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stage(s): {', '.join(unknown)} (choose from {', '.join(PIPELINE_STAGES)})")
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="ct",
+        description="Import, sign, verify and test container-tools artifacts from one entry point.",
+    )
+    sub = parser.add_subparsers(dest="command")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--tar-file", action="append", help="Tarball to process (repeatable).")
+    common.add_argument("--directory", default="dist/", help="Directory searched for tarballs when no --tar-file is given (default: dist/).")
+    common.add_argument("--query", help="Select tarballs from the artifact catalog (e.g. unsigned, untested).")
+    common.add_argument("--dry-run", action="store_true", help="Perform a dry run without executing commands.")
+
+    signing = argparse.ArgumentParser(add_help=False)
+    signing.add_argument("--gpg-key-id", help="GPG key ID; enables GPG signing.")
+    signing.add_argument("--passphrase", help="GPG key passphrase (optional, will prompt if needed).")
+    signing.add_argument("--cosign", action="store_true", help="Sign/verify with cosign (oci-archive references).")
+    signing.add_argument("--cosign-key", help="cosign key (private for signing, public for verifying; keyless if omitted).")
+    signing.add_argument("--cache-ttl", type=int, default=3600, help="cosign verification cache TTL in seconds (0 disables).")
+
+    imp = sub.add_parser("import", parents=[common], help="Import tarballs into Docker/the registry.")
+    imp.add_argument("--image-name", help="Destination image name (default: <target>:latest).")
+    sub.add_parser("sign", parents=[common, signing], help="Sign tarballs with gpg and/or cosign.")
+    sub.add_parser("verify", parents=[common, signing], help="Verify gpg (.asc) and/or cosign signatures.")
+    tst = sub.add_parser("test", parents=[common], help="Run container-structure-test (config: test/<target>.yaml).")
+    tst.add_argument("--image-name", help="Image to test (default: <target>:latest).")
+    tst.add_argument("--config", help="Test config (default: test/<target>.yaml).")
+    pipe = sub.add_parser("pipeline", parents=[common, signing], help="Run import, sign, verify and test in one process.")
+    pipe.add_argument("--image-name", help="Destination image name (default: <target>:latest).")
+    pipe.add_argument("--config", help="Test config (default: test/<target>.yaml).")
+    pipe.add_argument("--stages", type=parse_stages, default=list(PIPELINE_STAGES), help="Comma-separated stages (default: import,sign,verify,test).")
+
+    args = parser.parse_args()
+
+    # Show help if no subcommand is provided
+    if not args.command:
+        parser.print_help()
+        return
+
+    if args.query:
+        from catalog import QUERIES
+
+        if args.query not in QUERIES:
+            parser.error(f"unknown --query '{args.query}' (choose from {', '.join(sorted(QUERIES))})")
+
+    stages = args.stages if args.command == "pipeline" else [args.command]
+    sys.exit(run_stages(stages, args))
+
+if __name__ == "__main__":
+    main()
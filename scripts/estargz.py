@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+
+import argparse
+import copy
+import hashlib
+import io
+import json
+import re
+import struct
+import sys
+import tarfile
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+
+# Ensure local scripts directory is in import path
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from utils import logger
+
+# eStargz layout constants (see containerd/stargz-snapshotter docs/estargz.md)
+TOC_TAR_NAME = "stargz.index.json"
+FOOTER_SIZE = 51
+PREFETCH_LANDMARK = ".prefetch.landmark"
+NO_PREFETCH_LANDMARK = ".no.prefetch.landmark"
+LANDMARK_CONTENTS = b"\x0f"
+DEFAULT_CHUNK_SIZE = 4 << 20
+
+# Layer annotations understood by lazy-pulling snapshotters
+TOC_DIGEST_ANNOTATION = "containerd.io/snapshot/stargz/toc.digest"
+UNCOMPRESSED_SIZE_ANNOTATION = "io.containers.estargz.uncompressed-size"
+
+# Default PATH used to resolve commandTests commands inside the rootfs
+DEFAULT_PATH = ["/usr/local/sbin", "/usr/local/bin", "/usr/sbin", "/usr/bin", "/sbin", "/bin", "/opt/jdk/bin"]
+
+_TYPE_NAMES = {
+    tarfile.DIRTYPE: "dir",
+    tarfile.SYMTYPE: "symlink",
+    tarfile.LNKTYPE: "hardlink",
+    tarfile.CHRTYPE: "char",
+    tarfile.BLKTYPE: "block",
+    tarfile.FIFOTYPE: "fifo",
+}
+
+
+def _normalize_name(name):
+    """Return a tar member name without leading './' or '/'."""
+    name = name.lstrip("/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name.rstrip("/") if name not in ("", ".") else ""
+
+
+def _footer_bytes(toc_offset):
+    """Build the 51-byte empty gzip member that records the TOC offset in its extra field."""
+    subfield = f"{toc_offset:016x}STARGZ".encode("ascii")
+    extra = b"SG" + struct.pack("<H", len(subfield)) + subfield
+    header = b"\x1f\x8b\x08\x04" + b"\x00\x00\x00\x00" + b"\x00\xff" + struct.pack("<H", len(extra)) + extra
+    # Empty final stored deflate block, then CRC32 and ISIZE of the (empty) payload
+    footer = header + b"\x01\x00\x00\xff\xff" + struct.pack("<II", 0, 0)
+    assert len(footer) == FOOTER_SIZE
+    return footer
+
+
+def parse_footer(footer):
+    """Return the TOC offset recorded in an eStargz footer, or raise ValueError."""
+    if len(footer) != FOOTER_SIZE or footer[:3] != b"\x1f\x8b\x08" or not footer[3] & 0x04:
+        raise ValueError("Not an eStargz footer (missing gzip extra field)")
+    xlen = struct.unpack("<H", footer[10:12])[0]
+    extra = footer[12:12 + xlen]
+    if extra[:2] != b"SG":
+        raise ValueError("Not an eStargz footer (missing SG subfield)")
+    sublen = struct.unpack("<H", extra[2:4])[0]
+    subfield = extra[4:4 + sublen].decode("ascii", errors="replace")
+    m = re.fullmatch(r"([0-9a-f]{16})STARGZ", subfield)
+    if not m:
+        raise ValueError(f"Malformed eStargz footer subfield: {subfield!r}")
+    return int(m.group(1), 16)
+
+
+class _LayerWriter:
+    """Write a stream of independently decompressible gzip members and track offsets."""
+
+    def __init__(self, fh, level):
+        self.fh = fh
+        self.level = level
+        self.compressed = 0
+        self.uncompressed = 0
+        self.digest = hashlib.sha256()
+        self.diff_id = hashlib.sha256()
+        self._gz = None
+
+    def open_member(self):
+        """Start a new gzip member and return its compressed offset."""
+        self.close_member()
+        self._gz = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return self.compressed
+
+    def write(self, data):
+        self.uncompressed += len(data)
+        self.diff_id.update(data)
+        self._emit(self._gz.compress(data))
+
+    def close_member(self):
+        if self._gz is not None:
+            self._emit(self._gz.flush())
+            self._gz = None
+
+    def write_raw(self, data):
+        self.close_member()
+        self._emit(data)
+
+    def _emit(self, data):
+        if data:
+            self.fh.write(data)
+            self.digest.update(data)
+            self.compressed += len(data)
+
+
+def _toc_entry(member, name):
+    """Build the common TOC fields for a tar member."""
+    entry = {
+        "name": name,
+        "type": "reg" if member.isreg() else _TYPE_NAMES.get(member.type, "reg"),
+        "modtime": datetime.fromtimestamp(member.mtime, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "mode": member.mode,
+        "uid": member.uid,
+        "gid": member.gid,
+    }
+    if member.uname:
+        entry["userName"] = member.uname
+    if member.gname:
+        entry["groupName"] = member.gname
+    if member.issym() or member.islnk():
+        entry["linkName"] = _normalize_name(member.linkname) if member.islnk() else member.linkname
+    if member.ischr() or member.isblk():
+        entry["devMajor"] = member.devmajor
+        entry["devMinor"] = member.devminor
+    xattrs = {k[len("SCHILY.xattr."):]: v for k, v in member.pax_headers.items() if k.startswith("SCHILY.xattr.")}
+    if xattrs:
+        entry["xattrs"] = xattrs
+    return entry
+
+
+def _pad(size):
+    return b"\0" * ((tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE)
+
+
+def _append_member(writer, member, name, fobj, chunk_size, toc):
+    """Append one tar member as one or more gzip members and record it in the TOC."""
+    out = copy.copy(member)
+    out.name = name
+    offset = writer.open_member()
+    writer.write(out.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="surrogateescape"))
+
+    entry = _toc_entry(member, name)
+    if not member.isreg():
+        toc.append(entry)
+        return
+
+    entry["size"] = member.size
+    file_digest = hashlib.sha256()
+    chunk_offset = 0
+    entries = [entry]
+    while True:
+        data = fobj.read(min(chunk_size, member.size - chunk_offset)) if member.size else b""
+        if chunk_offset and not data:
+            break
+        if chunk_offset:
+            # Every chunk after the first starts its own gzip member so it can be fetched alone
+            offset = writer.open_member()
+            chunk = {"name": name, "type": "chunk", "offset": offset, "chunkOffset": chunk_offset}
+            entries.append(chunk)
+        else:
+            chunk = entry
+            entry["offset"] = offset
+        chunk["chunkSize"] = len(data)
+        chunk["chunkDigest"] = "sha256:" + hashlib.sha256(data).hexdigest()
+        file_digest.update(data)
+        writer.write(data)
+        chunk_offset += len(data)
+        if chunk_offset >= member.size:
+            break
+    if len(entries) == 1:
+        # Single-chunk files omit chunkSize, matching upstream writers
+        entry.pop("chunkSize", None)
+    entry["digest"] = "sha256:" + file_digest.hexdigest()
+    writer.write(_pad(member.size))
+    toc.extend(entries)
+
+
+def convert_to_estargz(src_path, dest_path, prioritized=None, chunk_size=DEFAULT_CHUNK_SIZE, level=6):
+    """Convert a (possibly compressed) rootfs tarball into an eStargz layer.
+
+    Args:
+        src_path: Path to the mkimage rootfs tarball
+        dest_path: Path of the eStargz blob to write
+        prioritized: Optional list of paths to place first, followed by the prefetch landmark
+        chunk_size: Maximum uncompressed size of each independently fetchable chunk
+        level: gzip compression level
+
+    Returns:
+        dict: Layer descriptor with digest, size, diffID and snapshotter annotations
+    """
+    prioritized = [_normalize_name(p) for p in (prioritized or []) if _normalize_name(p)]
+    toc = []
+
+    with tarfile.open(src_path, "r:*") as src:
+        members = src.getmembers()
+        by_name = {}
+        for m in members:
+            by_name.setdefault(_normalize_name(m.name), m)
+
+        order = []
+        seen = set()
+
+        def pull_forward(name):
+            """Append name after its parent directories and, for hardlinks, after the link target."""
+            if name in seen or name not in by_name:
+                return
+            seen.add(name)
+            # Parents must precede their children in the tar stream
+            for parent in reversed(PurePosixPath(name).parents[:-1]):
+                parent = str(parent)
+                if parent in by_name and parent not in seen:
+                    order.append(by_name[parent])
+                    seen.add(parent)
+            member = by_name[name]
+            # A hardlink can only be extracted once its target exists (e.g. perl -> perl5.x)
+            if member.islnk():
+                pull_forward(_normalize_name(member.linkname))
+            order.append(member)
+
+        for p in prioritized:
+            if p in by_name:
+                pull_forward(p)
+            else:
+                logger.warning(f"Prioritized file not found in rootfs: {p}")
+        prioritized_count = len(order)
+        for m in members:
+            name = _normalize_name(m.name)
+            if name and name not in seen:
+                order.append(m)
+                seen.add(name)
+
+        with open(dest_path, "wb") as fh:
+            writer = _LayerWriter(fh, level)
+            for i, m in enumerate(order):
+                if i == prioritized_count:
+                    _append_landmark(writer, PREFETCH_LANDMARK if prioritized_count else NO_PREFETCH_LANDMARK, toc)
+                fobj = src.extractfile(m) if m.isreg() else None
+                _append_member(writer, m, _normalize_name(m.name), fobj, chunk_size, toc)
+            if prioritized_count == len(order):
+                _append_landmark(writer, PREFETCH_LANDMARK if prioritized_count else NO_PREFETCH_LANDMARK, toc)
+
+            # TOC goes into its own member followed by the tar end-of-archive marker
+            toc_json = json.dumps({"version": 1, "entries": toc}, indent=1).encode("utf-8")
+            toc_offset = writer.open_member()
+            toc_info = tarfile.TarInfo(TOC_TAR_NAME)
+            toc_info.size = len(toc_json)
+            toc_info.mode = 0o644
+            writer.write(toc_info.tobuf(format=tarfile.PAX_FORMAT))
+            writer.write(toc_json + _pad(len(toc_json)))
+            writer.write(b"\0" * (tarfile.BLOCKSIZE * 2))
+            writer.write_raw(_footer_bytes(toc_offset))
+
+    descriptor = {
+        "mediaType": "application/vnd.oci.image.layer.v1.tar+gzip",
+        "digest": "sha256:" + writer.digest.hexdigest(),
+        "size": writer.compressed,
+        "diffID": "sha256:" + writer.diff_id.hexdigest(),
+        "annotations": {
+            TOC_DIGEST_ANNOTATION: "sha256:" + hashlib.sha256(toc_json).hexdigest(),
+            UNCOMPRESSED_SIZE_ANNOTATION: str(writer.uncompressed),
+        },
+        "prioritizedFiles": prioritized_count,
+    }
+    logger.info(
+        f"Wrote eStargz layer {dest_path}: {descriptor['size']} bytes, "
+        f"{len(toc)} TOC entries, {prioritized_count} prioritized"
+    )
+    return descriptor
+
+
+def _append_landmark(writer, name, toc):
+    """Append the landmark file that separates prioritized files from the rest."""
+    info = tarfile.TarInfo(name)
+    info.size = len(LANDMARK_CONTENTS)
+    info.mode = 0o644
+    _append_member(writer, info, name, io.BytesIO(LANDMARK_CONTENTS), DEFAULT_CHUNK_SIZE, toc)
+
+
+def _read_member(fh, offset, limit=None):
+    """Decompress the single gzip member starting at offset (optionally only the first limit bytes)."""
+    fh.seek(offset)
+    d = zlib.decompressobj(31)
+    out = bytearray()
+    while not d.eof:
+        block = fh.read(64 * 1024)
+        if not block:
+            raise ValueError(f"Truncated gzip member at offset {offset}")
+        out += d.decompress(block)
+        if limit is not None and len(out) >= limit:
+            break
+    return bytes(out)
+
+
+def read_toc(layer_path):
+    """Return (toc_dict, toc_digest) for an eStargz layer."""
+    with open(layer_path, "rb") as fh:
+        fh.seek(0, io.SEEK_END)
+        size = fh.tell()
+        if size < FOOTER_SIZE:
+            raise ValueError("File is too small to be an eStargz layer")
+        fh.seek(size - FOOTER_SIZE)
+        toc_offset = parse_footer(fh.read(FOOTER_SIZE))
+        toc_tar = _read_member(fh, toc_offset)
+    with tarfile.open(fileobj=io.BytesIO(toc_tar), mode="r:") as tf:
+        member = tf.next()
+        if member is None or member.name != TOC_TAR_NAME:
+            raise ValueError(f"TOC member {TOC_TAR_NAME} not found at offset {toc_offset}")
+        toc_json = tf.extractfile(member).read()
+    return json.loads(toc_json), "sha256:" + hashlib.sha256(toc_json).hexdigest()
+
+
+def _skip_headers(data):
+    """Return the number of bytes taken by the tar header blocks at the start of data."""
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:") as tf:
+        member = tf.next()
+        return member.offset_data
+
+
+def verify_estargz(layer_path, expected_toc_digest=None):
+    """Verify the TOC, chunk digests and file digests of an eStargz layer.
+
+    Args:
+        layer_path: Path to the eStargz blob
+        expected_toc_digest: Optional TOC digest (e.g. from the layer annotation) to compare against
+
+    Returns:
+        bool: True if the layer is consistent, False otherwise
+    """
+    try:
+        toc, toc_digest = read_toc(layer_path)
+    except (ValueError, OSError, tarfile.TarError, zlib.error) as e:
+        logger.error(f"Failed to read eStargz TOC from {layer_path}: {e}")
+        return False
+
+    ok = True
+    if expected_toc_digest and expected_toc_digest != toc_digest:
+        logger.error(f"TOC digest mismatch: expected {expected_toc_digest}, got {toc_digest}")
+        ok = False
+
+    file_digests = {}
+    with open(layer_path, "rb") as fh:
+        for entry in toc.get("entries", []):
+            if entry.get("type") not in ("reg", "chunk") or "offset" not in entry:
+                continue
+            name = entry["name"]
+            size = entry.get("chunkSize", entry.get("size", 0))
+            try:
+                data = _read_member(fh, entry["offset"], limit=None)
+                if entry["type"] == "reg":
+                    data = data[_skip_headers(data):]
+                chunk = data[:size]
+            except (ValueError, tarfile.TarError, zlib.error) as e:
+                logger.error(f"Failed to read chunk of {name} at offset {entry['offset']}: {e}")
+                ok = False
+                continue
+            if len(chunk) != size:
+                logger.error(f"Short chunk for {name} at offset {entry['offset']}: {len(chunk)} != {size}")
+                ok = False
+                continue
+            if entry.get("chunkDigest") and "sha256:" + hashlib.sha256(chunk).hexdigest() != entry["chunkDigest"]:
+                logger.error(f"Chunk digest mismatch for {name} at chunk offset {entry.get('chunkOffset', 0)}")
+                ok = False
+            if entry["type"] == "reg":
+                file_digests[name] = [entry, hashlib.sha256(chunk)]
+            elif name in file_digests:
+                file_digests[name][1].update(chunk)
+
+    for name, (entry, digest) in file_digests.items():
+        if entry.get("digest") and "sha256:" + digest.hexdigest() != entry["digest"]:
+            logger.error(f"File digest mismatch for {name}")
+            ok = False
+
+    # The whole blob must also read back as one tar stream listing exactly the TOC entries
+    toc_names = {e["name"] for e in toc.get("entries", []) if e.get("type") != "chunk"}
+    try:
+        stream_names = set()
+        with tarfile.open(layer_path, "r:gz") as tf:
+            for m in tf:
+                name = _normalize_name(m.name)
+                # Hardlinks must follow their targets or the layer cannot be extracted
+                if m.islnk() and _normalize_name(m.linkname) not in stream_names:
+                    logger.error(f"Hardlink {name} precedes its target {_normalize_name(m.linkname)}")
+                    ok = False
+                stream_names.add(name)
+        stream_names.discard(TOC_TAR_NAME)
+    except (OSError, EOFError, tarfile.TarError, zlib.error) as e:
+        logger.error(f"Layer is not a readable gzip tar stream: {e}")
+        return False
+    if stream_names != toc_names:
+        logger.error(f"TOC and tar stream disagree on {len(stream_names ^ toc_names)} entries")
+        ok = False
+
+    if ok:
+        logger.info(f"eStargz layer verified: {layer_path} ({len(toc.get('entries', []))} TOC entries, TOC {toc_digest})")
+    return ok
+
+
+def _resolve_in_rootfs(names, links, path):
+    """Resolve a path through symlinks recorded in the rootfs, returning every hop."""
+    hops = []
+    current = _normalize_name(path)
+    for _ in range(40):
+        if current not in names:
+            break
+        hops.append(current)
+        target = links.get(current)
+        if target is None:
+            break
+        base = PurePosixPath("/" + current).parent
+        current = _normalize_name(str(PurePosixPath(target) if target.startswith("/") else base / target))
+        current = _normalize_name(str(PurePosixPath(*_collapse(PurePosixPath("/" + current).parts))))
+    return hops
+
+
+def _collapse(parts):
+    out = []
+    for p in parts:
+        if p == "..":
+            if len(out) > 1:
+                out.pop()
+        elif p != ".":
+            out.append(p)
+    return out
+
+
+def prioritized_from_test_config(src_path, config_file):
+    """Derive a prioritized file list from the commandTests of a container-structure-test config.
+
+    Each command is resolved against DEFAULT_PATH inside the rootfs, following symlinks, so the
+    binaries exercised by the tests (e.g. /usr/bin/java -> /opt/jdk/bin/java) are fetched first.
+    """
+    text = Path(config_file).read_text()
+    commands = re.findall(r"^\s*-?\s*command:\s*[\"']?([^\"'\s#]+)", text, flags=re.MULTILINE)
+    with tarfile.open(src_path, "r:*") as src:
+        names = set()
+        links = {}
+        for m in src.getmembers():
+            name = _normalize_name(m.name)
+            names.add(name)
+            if m.issym():
+                links[name] = m.linkname
+    files = []
+    for cmd in commands:
+        candidates = [cmd] if cmd.startswith("/") else [f"{d}/{cmd}" for d in DEFAULT_PATH]
+        for candidate in candidates:
+            hops = _resolve_in_rootfs(names, links, candidate)
+            if hops:
+                files.extend(h for h in hops if h not in files)
+                break
+        else:
+            logger.warning(f"Command from {config_file} not found in rootfs: {cmd}")
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert mkimage rootfs tarballs into lazy-pullable eStargz layers.")
+    sub = parser.add_subparsers(dest="command")
+
+    conv = sub.add_parser("convert", help="Convert a rootfs tarball into an eStargz layer.")
+    conv.add_argument("--input", required=True, help="Path to the rootfs tarball (*.tar, gzip or plain).")
+    conv.add_argument("--output", help="Path of the eStargz blob (default: <input stem>.estargz).")
+    conv.add_argument("--prioritized-files", help="File with one path per line to place before the prefetch landmark.")
+    conv.add_argument("--test-config", help="container-structure-test YAML whose commandTests binaries are prioritized.")
+    conv.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Chunk size in bytes (default: 4 MiB).")
+    conv.add_argument("--level", type=int, default=6, help="gzip compression level (default: 6).")
+
+    ver = sub.add_parser("verify", help="Verify the TOC and chunk digests of an eStargz layer.")
+    ver.add_argument("--input", required=True, help="Path to the eStargz blob.")
+    ver.add_argument("--toc-digest", help="Expected TOC digest (defaults to the value in <input>.json if present).")
+
+    args = parser.parse_args()
+
+    # Show help if no subcommand is provided
+    if not args.command:
+        parser.print_help()
+        return
+
+    if args.command == "convert":
+        src = Path(args.input)
+        if not src.is_file():
+            logger.error(f"Input tarball not found: {src}")
+            sys.exit(1)
+        dest = Path(args.output) if args.output else src.with_suffix(".estargz")
+
+        prioritized = []
+        if args.prioritized_files:
+            prioritized.extend(
+                line.strip() for line in Path(args.prioritized_files).read_text().splitlines()
+                if line.strip() and not line.lstrip().startswith("#")
+            )
+        if args.test_config:
+            prioritized.extend(prioritized_from_test_config(src, args.test_config))
+
+        descriptor = convert_to_estargz(src, dest, prioritized, args.chunk_size, args.level)
+        Path(f"{dest}.json").write_text(json.dumps(descriptor, indent=2) + "\n")
+        logger.info(f"Layer descriptor saved to: {dest}.json")
+    else:
+        expected = args.toc_digest
+        descriptor_file = Path(f"{args.input}.json")
+        if not expected and descriptor_file.is_file():
+            expected = json.loads(descriptor_file.read_text()).get("annotations", {}).get(TOC_DIGEST_ANNOTATION)
+        if not verify_estargz(args.input, expected):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
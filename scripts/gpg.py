@@ -4,17 +4,20 @@ import os
 import subprocess
 import argparse
 import getpass
+import hashlib
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Import common utilities
-from utils import logger, run_command, find_tar_files, check_program_installed
+from utils import logger, run_command, find_tar_files, check_program_installed, timed, timed_command
+from catalog import record_signature, record_verification
 
 def is_valid_tar_file(tar_file):
     """Check if the file is a valid tar archive."""
     try:
         # Validate via tar -tf and check return code
-        stdout, stderr, rc = run_command(["tar", "-tf", str(tar_file)])
+        stdout, stderr, rc = run_command(["tar", "-tf", str(tar_file)], return_code=True)
         if rc != 0:
             logger.warning(f"File is not a valid tar archive: {tar_file}")
             return False
@@ -23,30 +26,35 @@ def is_valid_tar_file(tar_file):
         logger.warning(f"File is not a valid tar archive: {tar_file}")
         return False
 
-def sign_tarball_with_gpg(tar_file, gpg_key_id, passphrase=None, dry_run=False, force=False):
-    """Sign a tarball using GPG."""
+def _confirm_overwrite(signature_file, tar_file, force=False):
+    """Ask before replacing an existing signature (always yes with --force)."""
+    if not Path(signature_file).exists():
+        return True
+    if force:
+        logger.info(f"--force specified. Overwriting existing signature: {signature_file}")
+        return True
+    overwrite = input(f"File '{signature_file}' exists. Overwrite? (y/N) ").strip().lower()
+    if overwrite != "y":
+        logger.info(f"Skipping signing of {tar_file}.")
+        return False
+    return True
+
+def sign_tarball_with_gpg(tar_file, gpg_key_id, passphrase=None, dry_run=False, force=False, catalog=True, signature_file=None):
+    """Sign a tarball using GPG (and record it in the artifact catalog unless catalog=False).
+
+    Returns True if a signature was written (or would be, in a dry run), False if the user declined.
+    """
     try:
-        signature_file = f"{tar_file}.asc"  # Default to .asc for ASCII-armored signatures
+        signature_file = signature_file or f"{tar_file}.asc"  # Default to .asc for ASCII-armored signatures
         logger.info(f"Signing tarball: {tar_file} -> Signature: {signature_file}")
 
         # Check if the signature file already exists
-        if Path(signature_file).exists():
-            if not force:
-                overwrite = input(f"File '{signature_file}' exists. Overwrite? (y/N) ").strip().lower()
-                if overwrite != "y":
-                    logger.info(f"Skipping signing of {tar_file}.")
-                    return
-                else:
-                    try:
-                        Path(signature_file).unlink()
-                    except Exception:
-                        pass
-            else:
-                logger.info(f"--force specified. Overwriting existing signature: {signature_file}")
-                try:
-                    Path(signature_file).unlink()
-                except Exception:
-                    pass
+        if not _confirm_overwrite(signature_file, tar_file, force):
+            return False
+        try:
+            Path(signature_file).unlink()
+        except Exception:
+            pass
 
         # Construct the GPG signing command (avoid passing secrets via CLI)
         gpg_cmd = ["gpg", "--detach-sign", "--armor", "--batch", "--pinentry-mode", "loopback"]
@@ -65,39 +73,47 @@ def sign_tarball_with_gpg(tar_file, gpg_key_id, passphrase=None, dry_run=False,
                 cmd = list(gpg_cmd)
                 if pw is not None:
                     cmd.extend(["--passphrase-fd", "0"])
-                return subprocess.run(
-                    cmd + [str(tar_file)],
-                    check=False,
-                    text=True,
-                    input=(pw + "\n") if pw is not None else None,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
+                with timed_command("gpg") as cmd_metrics:
+                    result = subprocess.run(
+                        cmd + [str(tar_file)],
+                        check=False,
+                        text=True,
+                        input=(pw + "\n") if pw is not None else None,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                    )
+                    if result.returncode != 0:
+                        cmd_metrics.fail()
+                return result
 
-            result = None
-            if passphrase:
-                # Use provided passphrase securely via stdin
-                result = run_gpg_with_pass(passphrase)
-            else:
-                # First attempt without a passphrase
-                result = run_gpg_with_pass(None)
-                if result.returncode != 0 and "passphrase" in result.stderr.lower():
-                    # Prompt securely if a passphrase is required
-                    pw = getpass.getpass("Enter GPG key passphrase: ")
-                    result = run_gpg_with_pass(pw)
+            with timed("sign", nbytes=Path(tar_file).stat().st_size):
+                result = None
+                if passphrase:
+                    # Use provided passphrase securely via stdin
+                    result = run_gpg_with_pass(passphrase)
+                else:
+                    # First attempt without a passphrase
+                    result = run_gpg_with_pass(None)
+                    if result.returncode != 0 and "passphrase" in result.stderr.lower():
+                        # Prompt securely if a passphrase is required
+                        pw = getpass.getpass("Enter GPG key passphrase: ")
+                        result = run_gpg_with_pass(pw)
 
-            if result.returncode != 0:
-                raise Exception(f"GPG signing failed: {result.stderr}")
+                if result.returncode != 0:
+                    raise Exception(f"GPG signing failed: {result.stderr}")
 
         logger.info(f"Successfully signed tarball: {tar_file}")
         logger.info(f"Signature saved to: {signature_file}")
+        if catalog and not dry_run:
+            record_signature(tar_file, "gpg")
+        return True
 
     except Exception as e:
         logger.error(f"Failed to sign tarball: {tar_file}. Error: {e}")
         raise
 
-def verify_tarball_with_gpg(tar_file, sig_file, dry_run=False):
-    """Verify the signature of a tarball using GPG."""
+def verify_tarball_with_gpg(tar_file, sig_file, dry_run=False, catalog=True):
+    """Verify the signature of a tarball using GPG (and record the outcome unless catalog=False)."""
     try:
         if not Path(sig_file).exists():
             logger.warning(f"Signature file not found: {sig_file}")
@@ -112,13 +128,19 @@ def verify_tarball_with_gpg(tar_file, sig_file, dry_run=False):
         if dry_run:
             logger.info(f"[Dry Run] Skipping execution of: {' '.join(gpg_cmd)}")
         else:
-            result = subprocess.run(
-                gpg_cmd,
-                check=False,
-                text=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
+            with timed("verify", nbytes=Path(tar_file).stat().st_size) as phase, timed_command("gpg") as cmd_metrics:
+                result = subprocess.run(
+                    gpg_cmd,
+                    check=False,
+                    text=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+                if result.returncode != 0:
+                    phase.fail()
+                    cmd_metrics.fail()
+            if catalog:
+                record_verification(tar_file, "gpg", result.returncode == 0)
             if result.returncode == 0:
                 logger.info(f"Verification successful: {tar_file}")
                 return True
@@ -130,6 +152,129 @@ def verify_tarball_with_gpg(tar_file, sig_file, dry_run=False):
         logger.error(f"Failed to verify tarball: {tar_file}. Error: {e}")
         return False
 
+# Name of the checksum manifest written into the artifact directory
+MANIFEST_NAME = "SHA256SUMS"
+
+def sha256_file(path):
+    """Return the hex SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cached_sha256(tar_file):
+    """Return the digest from <name>.sha256 written by mkimage.sh if it is newer than the tarball."""
+    sum_file = Path(tar_file).with_suffix(".sha256")
+    try:
+        if sum_file.stat().st_mtime < Path(tar_file).stat().st_mtime:
+            return None
+        fields = sum_file.read_text().split()
+        if len(fields) >= 2 and Path(fields[1]).name == Path(tar_file).name and len(fields[0]) == 64:
+            return fields[0]
+    except (OSError, ValueError):
+        pass
+    return None
+
+def collect_digests(directory, tar_files, jobs=None):
+    """Return {relative path: sha256} for the artifacts, hashing only those without a fresh .sha256."""
+    directory = Path(directory)
+    digests = {}
+    to_hash = []
+    for tar_file in tar_files:
+        rel = Path(tar_file).relative_to(directory).as_posix()
+        cached = _cached_sha256(tar_file)
+        if cached:
+            digests[rel] = cached
+        else:
+            to_hash.append((rel, tar_file))
+    logger.info(f"Reusing {len(digests)} existing .sha256 files, hashing {len(to_hash)} artifacts")
+    # hashlib releases the GIL on large buffers, so threads hash in parallel
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        for rel, digest in zip([r for r, _ in to_hash], pool.map(sha256_file, [t for _, t in to_hash])):
+            digests[rel] = digest
+    return digests
+
+def sign_manifest(directory, tar_files, gpg_key_id, passphrase=None, dry_run=False, force=False, jobs=None):
+    """Write a SHA256SUMS manifest for all artifacts and sign it once with a detached signature."""
+    manifest = Path(directory) / MANIFEST_NAME
+    signature = Path(f"{manifest}.asc")
+    digests = collect_digests(directory, tar_files, jobs)
+    # sha256sum --check compatible format
+    content = "".join(f"{digest}  {rel}\n" for rel, digest in sorted(digests.items()))
+    if dry_run:
+        logger.info(f"[Dry Run] Would write and sign {manifest} with {len(digests)} entries:\n{content.rstrip()}")
+        return None
+    if not _confirm_overwrite(signature, manifest, force):
+        logger.info(f"Kept the existing {manifest}")
+        return None
+    # Sign staged copies and rename both into place, so a failed signing never leaves a manifest
+    # without its signature and the old signature stays until the new one exists
+    staged = manifest.with_name(f".{MANIFEST_NAME}.new")
+    staged_signature = signature.with_name(f".{signature.name}.new")
+    staged.write_text(content)
+    try:
+        staged_signature.unlink(missing_ok=True)
+        sign_tarball_with_gpg(
+            staged, gpg_key_id, passphrase=passphrase, force=True, catalog=False,
+            signature_file=staged_signature,
+        )
+        os.replace(staged_signature, signature)
+        os.replace(staged, manifest)
+    finally:
+        staged.unlink(missing_ok=True)
+        staged_signature.unlink(missing_ok=True)
+    logger.info(f"Wrote {manifest} with {len(digests)} entries")
+    for tar_file in tar_files:
+        record_signature(tar_file, "gpg")
+    return manifest
+
+def verify_manifest(directory, sig_file=None, jobs=None, dry_run=False):
+    """Verify the manifest signature once, then re-hash every listed artifact in parallel."""
+    directory = Path(directory)
+    manifest = directory / MANIFEST_NAME
+    sig_file = sig_file or f"{manifest}.asc"
+    if not manifest.exists():
+        logger.error(f"Manifest not found: {manifest}")
+        return False
+    if not verify_tarball_with_gpg(manifest, sig_file, dry_run=dry_run, catalog=False):
+        return False
+    if dry_run:
+        return True
+
+    entries = []
+    for line in manifest.read_text().splitlines():
+        if line.strip():
+            digest, rel = line.split(None, 1)
+            entries.append((rel.lstrip("*"), digest))
+
+    def check(entry):
+        rel, expected = entry
+        path = directory / rel
+        if not path.is_file():
+            return rel, "missing"
+        with timed("verify", nbytes=path.stat().st_size) as phase:
+            matches = sha256_file(path) == expected
+            if not matches:
+                phase.fail()
+        record_verification(path, "gpg", matches)
+        return rel, None if matches else "mismatch"
+
+    ok = True
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        for rel, problem in pool.map(check, entries):
+            if problem:
+                logger.error(f"Checksum {problem}: {rel}")
+                ok = False
+    listed = {rel for rel, _ in entries}
+    for tar_file in find_tar_files(directory):
+        rel = tar_file.relative_to(directory).as_posix()
+        if rel not in listed:
+            logger.warning(f"Artifact not covered by {MANIFEST_NAME}: {rel}")
+    if ok:
+        logger.info(f"All {len(entries)} artifacts match the signed {MANIFEST_NAME}")
+    return ok
+
 def main():
     parser = argparse.ArgumentParser(description="Sign or verify tarball archives using GPG.")
     parser.add_argument(
@@ -164,6 +309,16 @@ def main():
         action="store_true",
         help="Overwrite existing signature files without prompting.",
     )
+    parser.add_argument(
+        "--manifest",
+        action="store_true",
+        help=f"Sign or verify a single {MANIFEST_NAME} manifest for the whole directory instead of one signature per tarball.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of parallel hashing workers in manifest mode (default: CPU count).",
+    )
 
     # Parse arguments
     args = parser.parse_args()
@@ -177,6 +332,29 @@ def main():
     if not check_program_installed("gpg", "https://gnupg.org/download/"):
         exit(1)
 
+    # Manifest mode: one signature covering every artifact in the directory
+    if args.manifest:
+        directory = Path(args.directory)
+        if not directory.is_dir():
+            logger.error(f"Manifest mode requires a directory: {args.directory}")
+            exit(1)
+        if args.verify:
+            if not verify_manifest(directory, args.sig_file, args.jobs, args.dry_run):
+                exit(1)
+            return
+        if os.environ.get("GITHUB_ACTIONS") == "true":
+            logger.info("Detected GitHub Actions; skipping GPG signing in CI.")
+            return
+        if not args.gpg_key_id:
+            logger.error("GPG key ID (--gpg-key-id) is required for signing.")
+            exit(1)
+        tar_files = find_tar_files(directory)
+        if not tar_files:
+            logger.info("No .tar files found. Exiting.")
+            return
+        sign_manifest(directory, tar_files, args.gpg_key_id, args.passphrase, args.dry_run, args.force, args.jobs)
+        return
+
     # Determine if the input is a file, transport spec, or directory
     input_str = str(args.directory)
     tar_files = []
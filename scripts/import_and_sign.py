@@ -9,8 +9,9 @@ from pathlib import Path
 # Ensure local scripts directory is in import path
 sys.path.append(str(Path(__file__).resolve().parent))
 
-from utils import logger, run_command, check_program_installed
+from utils import logger, run_command, check_program_installed, timed
 from gpg import sign_tarball_with_gpg, is_valid_tar_file
+from catalog import record_archive_type
 
 
 def detect_archive_type(tar_path: Path) -> str:
@@ -59,17 +60,21 @@ def import_image(tar_file, image_name, transport="auto", insecure_policy=True, d
             logger.info(f"[Dry Run] Skipping execution of: {' '.join(cmd)}")
             return True
 
-        result = run_command(cmd)
-        try:
-            stdout, stderr, rc = result
-        except ValueError:
-            stdout, rc = result
-            stderr = ""
+        with timed("import", nbytes=tar_path.stat().st_size) as phase:
+            result = run_command(cmd, return_code=True)
+            try:
+                stdout, stderr, rc = result
+            except ValueError:
+                stdout, rc = result
+                stderr = ""
+            if rc != 0:
+                phase.fail()
         if rc != 0:
             logger.error(f"skopeo copy failed: {stderr or stdout}")
             return False
 
         logger.info(f"Imported image {image_name} from {tar_path} via skopeo ({transport})")
+        record_archive_type(tar_path, transport)
         return True
     else:
         # Fall back to docker import for plain rootfs tarballs
@@ -79,17 +84,21 @@ def import_image(tar_file, image_name, transport="auto", insecure_policy=True, d
             logger.info(f"[Dry Run] Skipping execution of: {' '.join(cmd)}")
             return True
 
-        result = run_command(cmd)
-        try:
-            stdout, stderr, rc = result
-        except ValueError:
-            stdout, rc = result
-            stderr = ""
+        with timed("import", nbytes=tar_path.stat().st_size) as phase:
+            result = run_command(cmd, return_code=True)
+            try:
+                stdout, stderr, rc = result
+            except ValueError:
+                stdout, rc = result
+                stderr = ""
+            if rc != 0:
+                phase.fail()
         if rc != 0:
             logger.error(f"docker import failed: {stderr or stdout}")
             return False
 
         logger.info(f"Imported image {image_name} from {tar_path} via docker import (rootfs)")
+        record_archive_type(tar_path, "rootfs")
         return True
 
 
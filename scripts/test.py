@@ -5,7 +5,8 @@ import argparse
 from pathlib import Path
 
 # Import common utilities
-from utils import logger, run_command, check_program_installed
+from utils import logger, run_command, check_program_installed, timed
+from catalog import record_test
 
 def _parse_run_result(result):
     """Normalize run_command return into (stdout, stderr, rc) with rc as int (0=success, 1=error)."""
@@ -88,7 +89,7 @@ def normalize_image_ref(image_id):
 def validate_image(image_id):
     """Check if the Docker image exists locally. Falls back to :latest if no tag is specified."""
     try:
-        result = run_command(["docker", "inspect", "--type=image", image_id])
+        result = run_command(["docker", "inspect", "--type=image", image_id], return_code=True)
         stdout, stderr, rc = _parse_run_result(result)
         if rc == 0:
             return True
@@ -97,7 +98,7 @@ def validate_image(image_id):
         normalized = normalize_image_ref(image_id)
         if normalized != image_id:
             logger.info(f"Image '{image_id}' not found, retrying with default tag: '{normalized}'")
-            result = run_command(["docker", "inspect", "--type=image", normalized])
+            result = run_command(["docker", "inspect", "--type=image", normalized], return_code=True)
             stdout, stderr, rc = _parse_run_result(result)
             if rc == 0:
                 return True
@@ -138,8 +139,11 @@ def run_container_test(image_id, config_file, dry_run=False):
             logger.info(f"[Dry Run] Skipping execution of: {' '.join(test_cmd)}")
             return
 
-        result = run_command(test_cmd, dry_run=dry_run)
-        stdout, stderr, rc = _parse_run_result(result)
+        with timed("test") as phase:
+            result = run_command(test_cmd, dry_run=dry_run, return_code=True)
+            stdout, stderr, rc = _parse_run_result(result)
+            if rc != 0 and not _is_cst_pass(stdout):
+                phase.fail()
 
         # Log the output
         if stdout:
@@ -153,6 +157,7 @@ def run_container_test(image_id, config_file, dry_run=False):
             logger.warning("container-structure-test returned a non-zero exit code, but output indicates PASS; treating as success.")
             rc = 0
 
+        record_test(image_id, rc == 0, config_file)
         if rc == 0:
             logger.info(f"Tests passed for image: {image_id} with config: {config_file}")
         else:
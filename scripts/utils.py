@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import json
+import time
+import atexit
+import fcntl
+import bisect
+import shutil
 import subprocess
 import logging
+from contextlib import contextmanager
 from pathlib import Path
 
 def setup_logging():
@@ -17,17 +25,209 @@ def setup_logging():
 # Create a global logger instance
 logger = setup_logging()
 
-def run_command(command, cwd=None, dry_run=False):
+# Metrics: in-memory histograms and counters, written as a Prometheus textfile
+# and a JSON summary at exit when CT_METRICS_DIR is set
+
+# Histogram buckets (seconds) for external commands and pipeline phases
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+METRIC_HELP = {
+    "ct_command_duration_seconds": ("histogram", "Wall time of external commands run by the tools."),
+    "ct_command_failures": ("counter", "External commands that exited non-zero or failed to start."),
+    "ct_phase_duration_seconds": ("histogram", "Wall time of push, sign, verify, import and test phases."),
+    "ct_phase_failures": ("counter", "Phases that raised or reported failure."),
+    "ct_bytes_processed": ("counter", "Artifact bytes processed per phase."),
+}
+
+# Name of the running tool, used as a label so textfiles from different tools never collide
+TOOL_NAME = Path(sys.argv[0]).stem or "python"
+
+# In-memory series: {(name, labels): {...}}; labels is a sorted tuple of (key, value)
+_series = {}
+
+def _labels(labels):
+    return tuple(sorted({"tool": TOOL_NAME, **{k: str(v) for k, v in labels.items()}}.items()))
+
+def observe(name, value, **labels):
+    """Record a value in a histogram series."""
+    key = (name, _labels(labels))
+    s = _series.get(key)
+    if s is None:
+        s = _series[key] = {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0, "min": value, "max": value}
+    idx = bisect.bisect_left(DURATION_BUCKETS, value)
+    if idx < len(DURATION_BUCKETS):
+        s["buckets"][idx] += 1
+    s["count"] += 1
+    s["sum"] += value
+    s["min"] = min(s["min"], value)
+    s["max"] = max(s["max"], value)
+
+def inc(name, value=1, **labels):
+    """Increment a counter series."""
+    key = (name, _labels(labels))
+    s = _series.get(key)
+    if s is None:
+        s = _series[key] = {"value": 0}
+    s["value"] += value
+
+class _Phase:
+    """Handle yielded by timed() and timed_command(); call fail() to record a failure without raising."""
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+@contextmanager
+def timed(phase, nbytes=0):
+    """Time a pipeline phase and count its bytes and failures.
+
+    Args:
+        phase: Phase name (push, sign, verify, import, test)
+        nbytes: Artifact bytes processed by the phase (optional)
+    """
+    handle = _Phase()
+    start = time.perf_counter()
+    try:
+        yield handle
+    except BaseException:
+        handle.fail()
+        raise
+    finally:
+        observe("ct_phase_duration_seconds", time.perf_counter() - start, phase=phase)
+        if nbytes:
+            inc("ct_bytes_processed", nbytes, phase=phase)
+        if handle.failed:
+            inc("ct_phase_failures", phase=phase)
+
+@contextmanager
+def timed_command(program):
+    """Time an external command; callers that check return codes themselves call fail() on error."""
+    handle = _Phase()
+    start = time.perf_counter()
+    try:
+        yield handle
+    except BaseException:
+        handle.fail()
+        raise
+    finally:
+        observe("ct_command_duration_seconds", time.perf_counter() - start, program=program)
+        if handle.failed:
+            inc("ct_command_failures", program=program)
+
+def _merge_series(previous):
+    """Add series persisted by earlier runs so counters and histograms accumulate across runs."""
+    merged = {key: dict(s, buckets=list(s["buckets"])) if "buckets" in s else dict(s) for key, s in _series.items()}
+    for item in previous:
+        key = (item["name"], tuple(sorted(item["labels"].items())))
+        old = item["data"]
+        cur = merged.get(key)
+        if cur is None:
+            merged[key] = old
+        elif "buckets" in cur and len(old.get("buckets", [])) == len(cur["buckets"]):
+            cur["buckets"] = [a + b for a, b in zip(cur["buckets"], old["buckets"])]
+            cur["count"] += old["count"]
+            cur["sum"] += old["sum"]
+            cur["min"] = min(cur["min"], old["min"])
+            cur["max"] = max(cur["max"], old["max"])
+        elif "value" in cur:
+            cur["value"] += old.get("value", 0)
+    return merged
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    escaped = (f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+def render_metrics(series, openmetrics=False):
+    """Render series as Prometheus text for the node-exporter textfile collector.
+
+    The textfile collector uses the classic text parser, which expects counters to be
+    typed under their _total sample name. With openmetrics=True the families are named
+    the OpenMetrics way (without _total) and the output ends with "# EOF".
+    """
+    lines = []
+    for name, (mtype, help_text) in METRIC_HELP.items():
+        family = sorted((labels, s) for (n, labels), s in series.items() if n == name)
+        if not family:
+            continue
+        family_name = f"{name}_total" if mtype == "counter" and not openmetrics else name
+        lines.append(f"# HELP {family_name} {help_text}")
+        lines.append(f"# TYPE {family_name} {mtype}")
+        for labels, s in family:
+            if mtype == "counter":
+                lines.append(f"{name}_total{_format_labels(labels)} {s['value']}")
+                continue
+            cumulative = 0
+            for bound, n in zip(DURATION_BUCKETS, s["buckets"]):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(float(bound))))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {s['count']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {s['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {s['sum']:.6f}")
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def write_metrics(directory=None):
+    """Write <tool>.prom (Prometheus text) and <tool>.json (summary) into the metrics directory.
+
+    Series from earlier runs stored in the JSON summary are merged in first, so the textfile
+    carries cumulative counters and histograms. Does nothing when no directory is configured.
+    """
+    directory = directory or os.environ.get("CT_METRICS_DIR")
+    if not directory or not _series:
+        return
+    try:
+        out_dir = Path(directory)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        prom_file = out_dir / f"{TOOL_NAME}.prom"
+        json_file = out_dir / f"{TOOL_NAME}.json"
+        with open(out_dir / f".{TOOL_NAME}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            previous = []
+            if json_file.exists():
+                try:
+                    previous = json.loads(json_file.read_text()).get("series", [])
+                except ValueError:
+                    logger.warning(f"Ignoring unreadable metrics summary: {json_file}")
+            series = _merge_series(previous)
+
+            summary = {"tool": TOOL_NAME, "updated": time.time(), "buckets": list(DURATION_BUCKETS), "series": []}
+            for (name, labels), s in sorted(series.items()):
+                entry = {"name": name, "labels": dict(labels), "data": s}
+                if "count" in s and s["count"]:
+                    entry["mean"] = s["sum"] / s["count"]
+                summary["series"].append(entry)
+
+            # Write atomically so the collector never reads a partial file
+            for path, text in ((prom_file, render_metrics(series)), (json_file, json.dumps(summary, indent=2) + "\n")):
+                tmp = path.with_name(f".{path.name}.tmp")
+                tmp.write_text(text)
+                os.replace(tmp, path)
+        logger.debug(f"Metrics written to {prom_file} and {json_file}")
+    except Exception as e:
+        logger.warning(f"Failed to write metrics to {directory}: {e}")
+
+atexit.register(write_metrics)
+
+def run_command(command, cwd=None, dry_run=False, return_code=False):
     """Run a shell command and return its output.
     
     Args:
         command: The command to run (string or list)
         cwd: Working directory to run the command in
         dry_run: If True, only log the command without executing
+        return_code: If True, also return the exit code
         
     Returns:
         stdout: Standard output from the command
         stderr: Standard error from the command (if capture_stderr=True)
+        returncode: Exit code of the command (only if return_code=True)
     """
     try:
         # Convert command list to string if needed
@@ -40,22 +240,28 @@ def run_command(command, cwd=None, dry_run=False):
         
         if dry_run:
             logger.info(f"[Dry Run] Skipping execution of: {cmd_str}")
-            return "", ""
-            
-        result = subprocess.run(
-            cmd_str,
-            shell=True,
-            check=False,  # Don't raise exception on non-zero exit
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=cwd,
-        )
-        
+            return ("", "", 0) if return_code else ("", "")
+
+        program = os.path.basename(cmd_str.split(maxsplit=1)[0]) if cmd_str.strip() else "unknown"
+        with timed_command(program) as cmd_metrics:
+            result = subprocess.run(
+                cmd_str,
+                shell=True,
+                check=False,  # Don't raise exception on non-zero exit
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=cwd,
+            )
+            if result.returncode != 0:
+                cmd_metrics.fail()
+
         if result.returncode != 0:
             logger.warning(f"Command exited with code {result.returncode}: {cmd_str}")
             logger.warning(f"Error output: {result.stderr.strip()}")
         
+        if return_code:
+            return result.stdout.strip(), result.stderr.strip(), result.returncode
         return result.stdout.strip(), result.stderr.strip()
         
     except Exception as e:
@@ -76,6 +282,9 @@ def find_tar_files(directory):
         logger.warning(f"No .tar files found in directory: {directory}")
     return tar_files
 
+# PATH lookups are cached for the life of the process (the ct CLI checks the same tools per stage)
+_program_paths = {}
+
 def check_program_installed(program_name, install_url=None):
     """Check if a program is installed and available in PATH.
     
@@ -86,20 +295,15 @@ def check_program_installed(program_name, install_url=None):
     Returns:
         bool: True if installed, False otherwise
     """
-    try:
-        subprocess.run(
-            ["which", program_name],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+    if program_name not in _program_paths:
+        _program_paths[program_name] = shutil.which(program_name)
+    if _program_paths[program_name]:
         return True
-    except subprocess.CalledProcessError:
-        if install_url:
-            logger.error(
-                f"{program_name} is not installed. "
-                f"To install {program_name}, visit {install_url}"
-            )
-        else:
-            logger.error(f"{program_name} is not installed.")
-        return False
+    if install_url:
+        logger.error(
+            f"{program_name} is not installed. "
+            f"To install {program_name}, visit {install_url}"
+        )
+    else:
+        logger.error(f"{program_name} is not installed.")
+    return False